@@ -0,0 +1,74 @@
+"""Builders for mod archives of different shapes and formats used by the extraction benchmarks."""
+import io
+import os
+import random
+import tarfile
+import zipfile
+
+import libarchive.constants
+import libarchive.public
+
+SCALE = float(os.environ.get("D4M_BENCH_ARCHIVE_SCALE", 1))
+
+# shape name -> function returning a list of (path inside the mod, size in bytes)
+SHAPES = {
+    "many_small": lambda: [(f"rom/small/{i // 100}/file{i}.bin", 4 * 1024) for i in range(int(2000 * SCALE))],
+    "few_huge": lambda: [(f"rom/huge{i}.bin", int(48 * 1024 * 1024 * SCALE)) for i in range(2)],
+    "deep_tree": lambda: [("/".join(f"d{depth}" for depth in range(i % 40)) + f"/file{i}.bin", 16 * 1024)
+                          for i in range(int(400 * SCALE))],
+    "single_root": lambda: [(f"rom/{i % 10}/file{i}.bin", 256 * 1024) for i in range(int(200 * SCALE))],
+}
+
+FORMATS = ["zip", "7z", "tar.gz"]
+
+
+def shape_files(shape: str) -> "list[tuple[str, int]]":
+    """Return the files of a mod of the given shape, including its config.toml."""
+    return [("config.toml", 0)] + [(path.lstrip("/"), size) for path, size in SHAPES[shape]()]
+
+
+def _contents(path: str, size: int) -> bytes:
+    if path == "config.toml":
+        return b'enabled = true\nname = "Benchmark mod"\nversion = "1.0.0"\n'
+    return random.Random(path).randbytes(size)  # incompressible, like audio and textures
+
+
+def build_archive(shape: str, archive_format: str, work_dir: str) -> str:
+    """Write a mod archive of the given shape to work_dir.
+
+    single_root archives nest the mod in a single top level folder, the others have
+    config.toml at the top level.
+
+    Returns: the path of the archive.
+    """
+    prefix = "BenchMod/" if shape == "single_root" else ""
+    files = [(prefix + path, size) for path, size in shape_files(shape)]
+    archive_path = os.path.join(work_dir, f"{shape}.{archive_format}")
+    if archive_format == "zip":
+        with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for path, size in files:
+                zf.writestr(path, _contents(path[len(prefix):], size))
+    elif archive_format == "tar.gz":
+        with tarfile.open(archive_path, "w:gz") as tf:
+            for path, size in files:
+                data = _contents(path[len(prefix):], size)
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+    elif archive_format == "7z":
+        tree_dir = os.path.join(work_dir, f"{shape}-tree")
+        for path, size in files:
+            dest = os.path.join(tree_dir, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as fd:
+                fd.write(_contents(path[len(prefix):], size))
+        cwd = os.getcwd()
+        os.chdir(tree_dir)  # libarchive stores paths relative to the working directory
+        try:
+            libarchive.public.create_file(archive_path, libarchive.constants.ARCHIVE_FORMAT_7ZIP,
+                                          [path for path, _ in files])
+        finally:
+            os.chdir(cwd)
+    else:
+        raise ValueError(archive_format)
+    return archive_path
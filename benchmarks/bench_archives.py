@@ -0,0 +1,137 @@
+"""Extraction and install throughput for archives of different shapes and formats.
+
+Besides timings, every benchmark reports MB/s and files/s, and the peak RSS and read/write
+syscall counts of one extra run in a forked child process (Linux only), in its extra_info.
+"""
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+from archives import FORMATS, SHAPES, build_archive, shape_files
+from synthetic import make_library
+
+MOCK_MOD_ID = 777
+CHILD_TIMEOUT = 600  # seconds to wait for the measuring run in the child process
+
+
+@pytest.fixture(scope="session", params=[(shape, fmt) for shape in SHAPES for fmt in FORMATS],
+                ids=lambda param: f"{param[0]}-{param[1]}")
+def archive(request, tmp_path_factory):
+    shape, archive_format = request.param
+    path = build_archive(shape, archive_format, str(tmp_path_factory.mktemp(f"{shape}-{archive_format}")))
+    files = shape_files(shape)
+    return path, len(files), sum(size for _, size in files)
+
+
+@pytest.fixture
+def empty_manager(tmp_path):
+    from d4m.manage import ModManager
+    make_library(str(tmp_path), 0)
+    return ModManager(str(tmp_path), os.path.join(str(tmp_path), "mods"))
+
+
+def _proc_stats() -> dict:
+    stats = {}
+    with open("/proc/self/status") as fd:
+        for line in fd:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                stats[key] = int(value.split()[0]) / 1024
+    with open("/proc/self/io") as fd:
+        for line in fd:
+            key, _, value = line.partition(":")
+            stats[key] = int(value)
+    return stats
+
+
+def _measure_in_child(func) -> dict:
+    """Run func once in a forked child and return its peak RSS and syscall counts."""
+    if not os.path.exists("/proc/self/io"):
+        return {}
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+
+    def run():
+        try:
+            before = _proc_stats()
+            func()
+            after = _proc_stats()
+            sender.send({
+                "peak_rss_mb": round(after["VmHWM"], 1),
+                "rss_growth_mb": round(after["VmHWM"] - before["VmRSS"], 1),
+                "read_syscalls": after["syscr"] - before["syscr"],
+                "write_syscalls": after["syscw"] - before["syscw"],
+            })
+        except BaseException as e:
+            sender.send({"error": f"{type(e).__name__}: {e}"})
+
+    child = ctx.Process(target=run)
+    child.start()
+    sender.close()  # only the child writes, so recv sees EOF if it dies without sending
+    try:
+        if not receiver.poll(CHILD_TIMEOUT):
+            child.kill()
+            raise RuntimeError(f"measuring run did not finish within {CHILD_TIMEOUT}s")
+        result = receiver.recv()
+    except EOFError:
+        child.join()
+        raise RuntimeError(f"measuring run exited with code {child.exitcode} without a result")
+    finally:
+        child.join()
+    if "error" in result:
+        raise RuntimeError(f"measuring run failed: {result['error']}")
+    return result
+
+
+def _run(benchmark, func, setup, file_count, total_bytes, rounds=3):
+    benchmark.pedantic(func, setup=setup, rounds=rounds)
+    if benchmark.stats is None:  # --benchmark-disable, func only ran once as a test
+        return
+    mean = benchmark.stats.stats.mean
+    benchmark.extra_info["mb_per_s"] = round(total_bytes / (1024 * 1024) / mean, 1)
+    benchmark.extra_info["files_per_s"] = round(file_count / mean)
+    setup()
+    benchmark.extra_info.update(_measure_in_child(func))
+
+
+def _clear_mods(mod_manager):
+    for folder in os.listdir(mod_manager.mods_path):
+        if not folder.startswith("."):
+            shutil.rmtree(os.path.join(mod_manager.mods_path, folder))
+    mod_manager.reload()
+
+
+def bench_extract_archive(benchmark, archive, tmp_path):
+    from d4m.manage import extract_archive, inspect_archive
+    path, file_count, total_bytes = archive
+    with open(path, "rb") as fd:
+        data = fd.read()
+    dest = str(tmp_path / "extracted")
+
+    def setup():
+        shutil.rmtree(dest, ignore_errors=True)
+
+    def extract():
+        mod_root, _ = inspect_archive(data)
+        extract_archive(data, dest, mod_root=mod_root)
+
+    _run(benchmark, extract, setup, file_count, total_bytes)
+
+
+def bench_install_from_archive(benchmark, archive, empty_manager):
+    path, file_count, total_bytes = archive
+    _run(benchmark, lambda: empty_manager.install_from_archive(path), lambda: _clear_mods(empty_manager),
+         file_count, total_bytes)
+
+
+def bench_install_mod(benchmark, archive, empty_manager, mock_api):
+    path, file_count, total_bytes = archive
+    with open(path, "rb") as fd:
+        mock_api.archives[("divamodarchive", str(MOCK_MOD_ID))] = fd.read()
+
+    def install():
+        empty_manager.install_mod(MOCK_MOD_ID, "Mod", origin="divamodarchive")
+
+    _run(benchmark, install, lambda: _clear_mods(empty_manager), file_count, total_bytes)
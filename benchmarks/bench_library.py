@@ -0,0 +1,58 @@
+"""Benchmarks for ModManager operations on synthetic libraries of 10, 1k and 10k mods."""
+import itertools
+import os
+import shutil
+
+import synthetic
+
+_spare_ids = itertools.count()
+
+
+def bench_load_mods(benchmark, mod_manager):
+    mods = benchmark(mod_manager.load_mods, mod_manager.mods_path)
+    assert len(mods) == len(mod_manager.mods)
+
+
+def bench_reload(benchmark, mod_manager):
+    benchmark(mod_manager.reload)
+
+
+def bench_save_priority(benchmark, mod_manager):
+    benchmark(mod_manager.save_priority)
+
+
+def bench_enable_disable(benchmark, mod_manager):
+    mod = mod_manager.mods[len(mod_manager.mods) // 2]
+
+    def toggle():
+        mod_manager.disable(mod)
+        mod_manager.enable(mod)
+
+    benchmark(toggle)
+
+
+def bench_mod_is_installed(benchmark, mod_manager):
+    managed = [m for m in mod_manager.mods if not m.is_simple()]
+    last = managed[-1]
+
+    def lookup():
+        mod_manager.mod_is_installed(last.id, origin=last.origin)
+        mod_manager.mod_is_installed(-1, origin=last.origin)
+
+    benchmark(lookup)
+
+
+def bench_delete_mod(benchmark, mod_manager, tmp_path):
+    # mods to delete are installed from an archive with config.toml at its top level, named after the archive
+    spare = synthetic.make_mod(str(tmp_path), "spare")
+    archive = shutil.make_archive(str(tmp_path / "spare"), "zip", spare)
+
+    def setup():
+        archive_path = str(tmp_path / f"spare{next(_spare_ids)}.zip")
+        shutil.copyfile(archive, archive_path)
+        mod_manager.install_from_archive(archive_path)
+        os.remove(archive_path)
+        return (mod_manager.mods[-1],), {}
+
+    benchmark.pedantic(mod_manager.delete_mod, setup=setup, rounds=20)
+    mod_manager.trash.join()
@@ -0,0 +1,17 @@
+"""Update check and install throughput against the local API stand-in (see d4m.mockserver)."""
+import itertools
+
+_mod_ids = itertools.count(1)
+
+
+def bench_check_for_updates(benchmark, mock_api, mod_manager, clear_api_caches):
+    benchmark.pedantic(mod_manager.check_for_updates, setup=clear_api_caches, rounds=5)
+
+
+def bench_install_mod(benchmark, mock_api, mod_manager, clear_api_caches):
+    def setup():
+        clear_api_caches()
+        return (next(_mod_ids), "Mod"), {"origin": "divamodarchive"}
+
+    benchmark.pedantic(mod_manager.install_mod, setup=setup, rounds=10)
+    benchmark.extra_info["archive_bytes"] = len(mock_api.mod_archive("divamodarchive", "1", str(mock_api.version)))
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from synthetic import make_library
+
+LIBRARY_SIZES = [int(size) for size in os.environ.get("D4M_BENCH_SIZES", "10,1000,10000").split(",")]
+FILES_PER_MOD = int(os.environ.get("D4M_BENCH_FILES_PER_MOD", 4))
+FILE_SIZE = int(os.environ.get("D4M_BENCH_FILE_SIZE", 1024))
+
+
+@pytest.fixture(scope="session", params=LIBRARY_SIZES, ids=lambda size: f"{size}mods")
+def library(request, tmp_path_factory):
+    """Path of a synthetic MegaMix+ install, shared by every benchmark using the same size."""
+    base_path = str(tmp_path_factory.mktemp(f"library{request.param}"))
+    make_library(base_path, request.param, files_per_mod=FILES_PER_MOD, file_size=FILE_SIZE)
+    return base_path
+
+
+@pytest.fixture
+def mod_manager(library):
+    from d4m.manage import ModManager
+    return ModManager(library, os.path.join(library, "mods"))
+
+
+@pytest.fixture(scope="session")
+def mock_api():
+    """Local stand-in for the mod APIs, with the d4m API modules pointed at it."""
+    from d4m.mockserver import MockApiServer
+    with MockApiServer(latency=float(os.environ.get("D4M_BENCH_LATENCY", 0)),
+                       bandwidth=int(os.environ.get("D4M_BENCH_BANDWIDTH", 0))) as server:
+        server.apply()
+        yield server
+
+
+@pytest.fixture
+def clear_api_caches():
+    import d4m.dma
+    import d4m.gamebanana
+
+    def clear():
+        d4m.gamebanana.mod_info_cache.clear()
+        d4m.dma.mod_info_cache.clear()
+
+    return clear
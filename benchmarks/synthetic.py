@@ -0,0 +1,68 @@
+"""Generators for synthetic DivaModLoader installs used by the benchmarks."""
+import os
+import random
+import zlib
+
+import toml
+
+ORIGINS = ["gamebanana", "divamodarchive"]
+
+
+def make_mod(mods_path: str, folder: str, files_per_mod: int = 4, file_size: int = 1024, enabled: bool = True,
+             modinfo: "dict | None" = None) -> str:
+    """Create a mod folder with a config.toml, an optional modinfo.toml and a small file tree.
+
+    Returns: the path of the mod folder.
+    """
+    mod_path = os.path.join(mods_path, folder)
+    os.makedirs(mod_path)
+    with open(os.path.join(mod_path, "config.toml"), "w", encoding="UTF-8") as fd:
+        toml.dump({
+            "enabled": enabled,
+            "name": f"Synthetic {folder}",
+            "author": f"author{zlib.crc32(folder.encode()) % 97}",
+            "version": "1.0.0",
+            "include": ["."]
+        }, fd)
+    if modinfo is not None:
+        with open(os.path.join(mod_path, "modinfo.toml"), "w") as fd:
+            toml.dump(modinfo, fd)
+    payload = b"\0" * file_size
+    for index in range(files_per_mod):
+        file_dir = os.path.join(mod_path, "rom", f"dir{index % 3}", "sub" if index % 2 else "")
+        os.makedirs(file_dir, exist_ok=True)
+        with open(os.path.join(file_dir, f"file{index}.bin"), "wb") as fd:
+            fd.write(payload)
+    return mod_path
+
+
+def make_library(base_path: str, mod_count: int, files_per_mod: int = 4, file_size: int = 1024,
+                 managed_ratio: float = 0.8, enabled_ratio: float = 0.9, seed: int = 0) -> str:
+    """Create a synthetic MegaMix+ install with DivaModLoader and mod_count mods.
+
+    A managed_ratio share of the mods get a modinfo.toml (alternating between origins), and the
+    DivaModLoader priority list contains every mod in a shuffled order.
+
+    Returns: the path of the mods folder.
+    """
+    rng = random.Random(seed)
+    mods_path = os.path.join(base_path, "mods")
+    os.makedirs(mods_path, exist_ok=True)
+    folders = []
+    for index in range(mod_count):
+        folder = f"mod{index:05d}"
+        modinfo = None
+        if rng.random() < managed_ratio:
+            modinfo = {
+                "id": 100000 + index,
+                "hash": f"hash{index}",
+                "origin": ORIGINS[index % len(ORIGINS)],
+                "category": "Mod"
+            }
+        make_mod(mods_path, folder, files_per_mod=files_per_mod, file_size=file_size,
+                 enabled=rng.random() < enabled_ratio, modinfo=modinfo)
+        folders.append(folder)
+    rng.shuffle(folders)
+    with open(os.path.join(base_path, "config.toml"), "w", encoding="UTF-8") as fd:
+        toml.dump({"enabled": True, "mods": "mods", "version": "1.0.0", "priority": folders}, fd)
+    return mods_path
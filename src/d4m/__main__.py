@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 import sys
+
+import d4m.profiling
+if d4m.profiling.profiling_requested():  # start before the UI modules are imported
+    d4m.profiling.start_session_profile()
+
 if "-g" in sys.argv:
     import d4m.gui
     d4m.gui.main()
@@ -1,9 +1,16 @@
+import concurrent.futures
+import contextlib
 import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import d4m.gamebanana as gamebanana
 import d4m.dma as dma
 import d4m.manage
-import requests
+import d4m.metrics as metrics
+import d4m.net as net
+from d4m.tracing import span
 
 SUPPORTED_APIS = {
     "divamodarchive": dma,
@@ -15,6 +22,14 @@ class UnsupportedAPIError(Exception):
     pass
 
 
+class OperationCancelled(RuntimeError):
+    pass
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SEARCH_DEADLINE = 20  # seconds a search waits for the next page of an origin
+
+
 def multi_fetch_mod_data(mod_info: "list[tuple[int, str]]", origin="gamebanana") -> "list[dict]":
     """Fetch data for multiple mods from the requested origin.
 
@@ -26,7 +41,8 @@ def multi_fetch_mod_data(mod_info: "list[tuple[int, str]]", origin="gamebanana")
     """
     if origin not in SUPPORTED_APIS.keys():
         raise UnsupportedAPIError(origin)
-    return SUPPORTED_APIS[origin].multi_fetch_mod_data(mod_info)
+    with span("api.multi_fetch_mod_data", origin=origin, count=len(mod_info)):
+        return SUPPORTED_APIS[origin].multi_fetch_mod_data(mod_info)
 
 
 def fetch_mod_data(mod_id: int, category: str, origin: str = "gamebanana") -> "dict":
@@ -40,7 +56,90 @@ def fetch_mod_data(mod_id: int, category: str, origin: str = "gamebanana") -> "d
     """
     if origin not in SUPPORTED_APIS.keys():
         raise UnsupportedAPIError(origin)
-    return SUPPORTED_APIS[origin].fetch_mod_data(mod_id, category)
+    with span("api.fetch_mod_data", origin=origin, mod_id=mod_id):
+        return SUPPORTED_APIS[origin].fetch_mod_data(mod_id, category)
+
+
+class _Batch:
+    def __init__(self):
+        self.keys = {}  # str(mod id) -> (mod id, category)
+        self.results = {}
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModDataLoader:
+    """Coalesces lookups of single mods into bulk requests.
+
+    A lookup waits up to `window` seconds for others to arrive, then every pending lookup of an
+    origin is fetched with one multi_fetch_mod_data call. Mods hinted with `hint` (e.g. every
+    installed mod) join the first batch of their origin, so even lookups made one after another
+    only cost a request per origin.
+
+    Params:
+        window - seconds to collect lookups for before fetching
+        max_hints - maximum number of hinted mods added to one batch
+    """
+
+    def __init__(self, window: float = 0.02, max_hints: int = 100):
+        self.window = window
+        self.max_hints = max_hints
+        self._lock = threading.Lock()
+        self._batches = {}  # origin -> batch being collected
+        self._hints = {}  # origin -> {str(mod id): (mod id, category)}
+
+    def hint(self, mod_id, category: str, origin: str):
+        """Note that this mod is likely to be looked up soon."""
+        with self._lock:
+            self._hints.setdefault(origin, {})[str(mod_id)] = (mod_id, category)
+
+    def clear_hints(self):
+        with self._lock:
+            self._hints.clear()
+
+    def load(self, mod_id, category: str, origin: str = "gamebanana") -> dict:
+        """Fetch data for a mod, batched with other lookups. Same result as fetch_mod_data."""
+        if origin not in SUPPORTED_APIS.keys():
+            raise UnsupportedAPIError(origin)
+        if mod_id in SUPPORTED_APIS[origin].mod_info_cache:
+            return fetch_mod_data(mod_id, category, origin=origin)
+        key = str(mod_id)
+        with self._lock:
+            batch = self._batches.get(origin)
+            leader = batch is None
+            if leader:
+                batch = self._batches[origin] = _Batch()
+            batch.keys[key] = (mod_id, category)
+        if leader:
+            time.sleep(self.window)
+            self._fetch(origin, batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        if key not in batch.results:
+            raise RuntimeError(f"{origin} returned no data for mod {mod_id}")
+        return batch.results[key]
+
+    def _fetch(self, origin: str, batch: _Batch):
+        with self._lock:
+            del self._batches[origin]  # lookups from now on start a new batch
+            hints = self._hints.get(origin, {})
+            for key in list(hints)[:self.max_hints]:
+                mod_id, category = hints.pop(key)
+                if mod_id not in SUPPORTED_APIS[origin].mod_info_cache:
+                    batch.keys.setdefault(key, (mod_id, category))
+        try:
+            with span("api.mod_data_loader", origin=origin, count=len(batch.keys)):
+                for data in multi_fetch_mod_data(list(batch.keys.values()), origin=origin):
+                    batch.results[str(data["id"])] = data
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+mod_data_loader = ModDataLoader()
 
 
 def search_mods(query: str, origin: str = "gamebanana") -> "list[tuple[any,any]]":
@@ -53,17 +152,207 @@ def search_mods(query: str, origin: str = "gamebanana") -> "list[tuple[any,any]]
     Returns: a list of dicts with the keys name, id, author, category, and origin."""
     if origin not in SUPPORTED_APIS.keys():
         raise UnsupportedAPIError(origin)
-    return SUPPORTED_APIS[origin].search_mods(query)
+    with span("api.search_mods", origin=origin, query=query) as s:
+        results = SUPPORTED_APIS[origin].search_mods(query)
+        s.set(count=len(results))
+        return results
+
+
+def fetch_catalog_page(page: int, origin: str = "gamebanana") -> "list[dict]":
+    """Fetch a page of every mod available from the requested origin, most recently modified first.
+
+    Params:
+        page - page to fetch, starting at 0
+        origin - origin API to use (default: gamebanana)
+
+    Returns: a list of dicts with the keys name, id, author, category, origin, like_count, download_count
+    and date (unix time of the last modification). Empty once past the last page.
+    """
+    if origin not in SUPPORTED_APIS.keys():
+        raise UnsupportedAPIError(origin)
+    with span("api.fetch_catalog_page", origin=origin, page=page) as s:
+        entries = SUPPORTED_APIS[origin].fetch_catalog_page(page)
+        s.set(count=len(entries))
+        return entries
+
+
+def iter_search_pages(query: str, origin: str = "gamebanana", prefetch: bool = True):
+    """Search for mods matching `query` on the requested origin, one page at a time.
+
+    Pages are only fetched as the generator is advanced, see iter_pages.
+
+    Yields: lists of dicts with the keys name, id, author, category, and origin.
+    """
+    if origin not in SUPPORTED_APIS.keys():
+        raise UnsupportedAPIError(origin)
+
+    def fetch_page(page):
+        with span("api.search_page", origin=origin, query=query, page=page) as s:
+            results, has_more = SUPPORTED_APIS[origin].search_page(query, page)
+            s.set(count=len(results))
+            return results, has_more
+
+    return iter_pages(fetch_page, prefetch=prefetch)
+
+
+def iter_pages(fetch_page, prefetch: bool = True):
+    """Generator over the pages returned by fetch_page, starting at page 0.
+
+    With prefetch, the next page is requested in the background as soon as a page arrives, so it
+    is usually ready by the time the consumer asks for it. Results already yielded by an earlier
+    page (pages can shift while being read) are left out.
+
+    A prefetch runs under the net.deadline the consumer was in when it was started, and none is started
+    once that deadline has passed.
+
+    Params:
+        fetch_page - called with a page number, returns (results, whether there may be more pages).
+                     Results are dicts with an id and an origin.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="d4m-page-prefetch") if prefetch else None
+    seen = set()
+    page = 0
+    upcoming = None
+
+    def fetch_within(page, until):
+        # the deadline of the consumer is thread local, the prefetch thread has to enter it again
+        with net.deadline(until - time.monotonic()) if until is not None else contextlib.nullcontext():
+            return fetch_page(page)
+
+    def prefetch_page(page):
+        until = net.current_deadline()
+        if until is not None and time.monotonic() >= until:
+            return None  # left for whoever asks for the page next, under their deadline
+        return executor.submit(fetch_within, page, until)
+
+    def take_page(page):
+        nonlocal upcoming
+        future, upcoming = upcoming, None
+        if future is not None:
+            until = net.current_deadline()
+            try:
+                return future.result(timeout=None if until is None else max(until - time.monotonic(), 0))
+            except concurrent.futures.TimeoutError:  # not the builtin TimeoutError before python 3.11
+                raise net.DeadlineExceeded(f"page {page} not ready before the deadline")
+            except net.DeadlineExceeded:
+                if until is not None and time.monotonic() >= until:
+                    raise
+                # prefetched under an earlier, shorter deadline, fetched again below
+        return fetch_page(page)
+
+    try:
+        while True:
+            results, has_more = take_page(page)
+            if executor and has_more:
+                upcoming = prefetch_page(page + 1)
+            fresh = [r for r in results if (r["origin"], str(r["id"])) not in seen]
+            seen.update((r["origin"], str(r["id"])) for r in fresh)
+            yield fresh
+            if not has_more:
+                return
+            page += 1
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def next_pages(pagers: dict, timeout: float = SEARCH_DEADLINE) -> "tuple[dict, dict]":
+    """Advance the pagers of several origins at once, e.g. generators from iter_search_pages.
+
+    Params:
+        pagers - origin -> generator of pages
+        timeout - seconds to wait for the pages, None to wait as long as they take
+
+    Returns: a dict of origin -> next page (None once its pager is exhausted), and a dict of origin ->
+    exception for the origins that failed or missed the deadline. Their pagers can't be used anymore.
+    """
+    until = None if timeout is None else time.monotonic() + timeout
+
+    def advance(pager):
+        with net.deadline(until - time.monotonic()) if until is not None else contextlib.nullcontext():
+            return next(pager, None)
+
+    pool = ThreadPoolExecutor(max_workers=max(len(pagers), 1), thread_name_prefix="d4m-search")
+    futures = {origin: pool.submit(advance, pager) for origin, pager in pagers.items()}
+    wait(futures.values(), timeout=timeout)
+    pool.shutdown(wait=False)  # late origins are abandoned, the deadline bounds their requests and prefetching
+    pages = {}
+    errors = {}
+    for origin, future in futures.items():
+        if not future.done():
+            errors[origin] = net.DeadlineExceeded(f"no answer within {timeout}s")
+        elif future.exception() is not None:
+            errors[origin] = future.exception()
+        else:
+            pages[origin] = future.result()
+    return pages, errors
+
+
+def changed_mod_ids(since: float, origin: str = "gamebanana", max_pages: int = 10):
+    """Return the ids (as strings) of the mods from origin modified after since (unix time).
+
+    Returns None when the changes can't be listed in max_pages catalog pages, or when the catalog
+    listing is empty (likely unsupported), in which case every mod should be checked instead.
+    """
+    changed = set()
+    for page in range(max_pages):
+        entries = fetch_catalog_page(page, origin=origin)
+        if not entries:
+            return changed if page > 0 else None
+        changed.update(str(entry["id"]) for entry in entries if entry["date"] >= since)
+        if min(entry["date"] for entry in entries) < since:
+            return changed
+    return None
+
+
+def remember_mod_data(mod_id, data: dict, origin: str = "gamebanana"):
+    """Cache data fetched earlier for a mod, so fetch_mod_data returns it without a request.
+
+    Data already in the cache is kept, it can't be older.
+    """
+    if origin not in SUPPORTED_APIS.keys():
+        raise UnsupportedAPIError(origin)
+    cache = SUPPORTED_APIS[origin].mod_info_cache
+    if mod_id not in cache:
+        cache[mod_id] = data
+
+
+def download_mod(download_url: str, progress=None, cancelled: threading.Event = None) -> bytes:
+    """Download a mod archive from download_url.
+
+    Params:
+        progress - called with (bytes received, total bytes) as the download goes, total is 0 if unknown
+        cancelled - if given, the download stops with OperationCancelled once this event is set
+
+    Returns: the raw bytes of the archive.
+    """
+    with span("api.download_mod", url=download_url) as s:
+        if progress is None and cancelled is None:
+            resp = net.get(download_url)
+            if resp.status_code != 200:
+                raise RuntimeError(f"Failed to download mod from {download_url}")
+            s.set(bytes=len(resp.content))
+            return resp.content
+        with net.get(download_url, stream=True) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"Failed to download mod from {download_url}")
+            total = int(resp.headers.get("Content-Length") or 0)
+            buf = bytearray()
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                if cancelled is not None and cancelled.is_set():
+                    raise OperationCancelled(f"download of {download_url} cancelled")
+                buf += chunk
+                if progress:
+                    progress(len(buf), total)
+        s.set(bytes=len(buf))
+        return bytes(buf)
 
 
 def download_and_extract_mod(download_url: str, destination: str):
     """Download a mod from download_url and extract it to destination.
     This function is only here for backwards compatibility.
     """
-    resp = requests.get(download_url)
-    if resp.status_code != 200:
-        raise RuntimeError(f"Failed to download mod from {download_url}")
-    d4m.manage.extract_archive(resp.content, destination)
+    d4m.manage.extract_archive(download_mod(download_url), destination)
 
 
 @functools.lru_cache(maxsize=10)
@@ -75,3 +364,6 @@ def download_favicon(origin: str) -> bytes:
     if origin not in SUPPORTED_APIS.keys():
         raise UnsupportedAPIError(origin)
     return SUPPORTED_APIS[origin].download_favicon()
+
+
+metrics.register_lru_cache("download_favicon", download_favicon)
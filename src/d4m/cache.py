@@ -0,0 +1,100 @@
+"""Thread-safe cache of mod data, shared by the threads looking mods up.
+
+Lookups missing from the cache are single-flight: while a thread fetches a mod, other threads
+asking for the same mod wait for that fetch instead of sending a request of their own.
+"""
+import threading
+
+import d4m.metrics as metrics
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class ModInfoCache:
+    """Mod id -> mod data, safe to read and fill from several threads.
+
+    Params:
+        name - cache name reported in metrics
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._data = {}
+        self._flights = {}  # mod id -> fetch in progress for it
+
+    def __contains__(self, mod_id) -> bool:
+        return mod_id in self._data
+
+    def __getitem__(self, mod_id) -> dict:
+        return self._data[mod_id]
+
+    def __setitem__(self, mod_id, value: dict):
+        with self._lock:
+            self._data[mod_id] = value
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def fetch_many(self, mod_ids: list, fetch) -> dict:
+        """Return the data of every mod in mod_ids, fetching the ones not cached yet.
+
+        Mods already being fetched by another thread are waited for, the rest are fetched with a
+        single call to fetch. If a fetch fails, its error is raised in every thread waiting for it.
+
+        Params:
+            mod_ids - ids of the mods to look up
+            fetch - called with a list of ids to fetch, returns a dict of mod id -> data. Ids left
+                    out of the dict are missing from the result.
+
+        Returns: a dict of mod id -> data, for the mods that were found.
+        """
+        found = {}
+        waiting = []  # flights of other threads
+        missing = []
+        with self._lock:
+            for mod_id in dict.fromkeys(mod_ids):
+                if mod_id in self._data:
+                    found[mod_id] = self._data[mod_id]
+                    metrics.cache_lookup(self.name, True)
+                elif mod_id in self._flights:
+                    waiting.append((mod_id, self._flights[mod_id]))
+                    metrics.inc("cache.coalesced", label=self.name)
+                else:
+                    missing.append(mod_id)
+                    metrics.cache_lookup(self.name, False)
+            flight = _Flight()
+            for mod_id in missing:
+                self._flights[mod_id] = flight
+
+        if missing:
+            try:
+                fetched = fetch(missing)
+            except Exception as e:
+                flight.error = e
+                raise
+            else:
+                with self._lock:
+                    self._data.update(fetched)
+                found.update(fetched)
+            finally:
+                with self._lock:
+                    for mod_id in missing:
+                        self._flights.pop(mod_id, None)
+                flight.done.set()
+
+        for mod_id, other in waiting:
+            other.done.wait()
+            if other.error is not None:
+                raise other.error
+            if mod_id in self._data:
+                found[mod_id] = self._data[mod_id]
+        return found
@@ -0,0 +1,253 @@
+"""Local mirror of the mods available from every origin, for instant and offline search.
+
+The mirror is an SQLite database with an FTS5 full-text index over mod names and authors. It is
+filled page by page from each origin's catalog listing (most recently modified first), so after
+the first sync, a re-sync only fetches the pages modified since the previous one.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import appdirs
+
+import d4m.api as api
+import d4m.metrics as metrics
+from d4m.tracing import span
+
+CATALOG_PATH = os.path.join(appdirs.user_cache_dir("d4m"), "catalog.sqlite3")
+SORT_ORDERS = {
+    "relevance": None,  # best matches first, newest first without a query
+    "date": "mods.date DESC",
+    "likes": "mods.like_count DESC",
+    "downloads": "mods.download_count DESC",
+    "name": "mods.name COLLATE NOCASE"
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mods (
+    origin TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    author TEXT NOT NULL,
+    category TEXT NOT NULL,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    download_count INTEGER NOT NULL DEFAULT 0,
+    date REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (origin, id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS mods_fts USING fts5(
+    name, author, content='mods', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS mods_ai AFTER INSERT ON mods BEGIN
+    INSERT INTO mods_fts(rowid, name, author) VALUES (new.rowid, new.name, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS mods_ad AFTER DELETE ON mods BEGIN
+    INSERT INTO mods_fts(mods_fts, rowid, name, author) VALUES ('delete', old.rowid, old.name, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS mods_au AFTER UPDATE ON mods BEGIN
+    INSERT INTO mods_fts(mods_fts, rowid, name, author) VALUES ('delete', old.rowid, old.name, old.author);
+    INSERT INTO mods_fts(rowid, name, author) VALUES (new.rowid, new.name, new.author);
+END;
+CREATE TABLE IF NOT EXISTS sync_state (
+    origin TEXT PRIMARY KEY,
+    newest REAL NOT NULL,  -- modification date of the newest mod seen by the last complete sync
+    synced_at REAL NOT NULL
+);
+"""
+
+
+class ModCatalog:
+    """Mirror of the mod catalogs of every origin in api.SUPPORTED_APIS.
+
+    A catalog can be shared by threads, e.g. synced in the background while the UI searches it.
+
+    Params:
+        path - path of the database, created if it doesn't exist
+    """
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        try:
+            self._db.executescript(_SCHEMA)
+        except sqlite3.OperationalError as e:
+            self._db.close()
+            raise RuntimeError(f"the mod catalog needs SQLite with FTS5 support ({e})")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def last_synced(self, origin: str):
+        """Return when origin was last synced completely (unix time), or None if it never was."""
+        with self._lock:
+            row = self._db.execute("SELECT synced_at FROM sync_state WHERE origin = ?", (origin,)).fetchone()
+        return row["synced_at"] if row else None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM mods").fetchone()[0]
+
+    def sync(self, origins=None, full: bool = False, progress=None) -> int:
+        """Bring the mirror up to date with the origins.
+
+        An incremental sync stops at the first page older than the previous sync. A full sync reads
+        every page, and forgets the mods that are no longer listed.
+
+        Params:
+            origins - origins to sync, every supported origin by default
+            full - read every page even if the mirror is up to date
+            progress - called with (origin, mods synced so far) after each page
+
+        Returns: the number of mods read from the origins.
+        """
+        changed = 0
+        for origin in origins or api.SUPPORTED_APIS.keys():
+            with span("catalog.sync", origin=origin, full=full) as s:
+                synced = self._sync_origin(origin, full, progress)
+                s.set(changed=synced)
+            metrics.inc("catalog.synced_mods", synced, label=origin)
+            changed += synced
+        return changed
+
+    def sync_if_stale(self, max_age: float, origins=None) -> int:
+        """Sync the origins whose last complete sync is older than max_age seconds."""
+        now = time.time()
+        stale = [origin for origin in origins or api.SUPPORTED_APIS.keys()
+                 if now - (self.last_synced(origin) or 0) > max_age]
+        return self.sync(stale) if stale else 0
+
+    def _sync_origin(self, origin: str, full: bool, progress) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT newest FROM sync_state WHERE origin = ?", (origin,)).fetchone()
+        known_newest = 0 if full or row is None else row["newest"]
+        newest = known_newest
+        seen = set()
+        page = 0
+        while True:
+            entries = api.fetch_catalog_page(page, origin=origin)
+            if not entries:
+                break
+            with self._lock, self._db:
+                self._db.executemany("""
+                    INSERT INTO mods (origin, id, name, author, category, like_count, download_count, date)
+                    VALUES (:origin, :id, :name, :author, :category, :like_count, :download_count, :date)
+                    ON CONFLICT (origin, id) DO UPDATE SET
+                        name = excluded.name, author = excluded.author, category = excluded.category,
+                        like_count = excluded.like_count, download_count = excluded.download_count,
+                        date = excluded.date
+                """, [dict(entry, origin=origin, category=str(entry["category"])) for entry in entries])
+            seen.update(entry["id"] for entry in entries)
+            newest = max(newest, max(entry["date"] for entry in entries))
+            if progress:
+                progress(origin, len(seen))
+            # entries as old as the last sync may still be new, they could share its timestamp
+            if min(entry["date"] for entry in entries) < known_newest:
+                break
+            page += 1
+        # the sync state only moves forward once every new page was read, an interrupted sync starts over
+        with self._lock, self._db:
+            if full:
+                self._db.execute("CREATE TEMP TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY)")
+                self._db.execute("DELETE FROM seen")
+                self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", [(mod_id,) for mod_id in seen])
+                self._db.execute("DELETE FROM mods WHERE origin = ? AND id NOT IN (SELECT id FROM seen)", (origin,))
+            self._db.execute("INSERT OR REPLACE INTO sync_state (origin, newest, synced_at) VALUES (?, ?, ?)",
+                             (origin, newest, time.time()))
+        return len(seen)
+
+    def search(self, query: str = "", origin: str = None, author: str = None, category: str = None,
+               min_likes: int = 0, min_downloads: int = 0, sort: str = "relevance",
+               limit: int = 50, offset: int = 0) -> "list[dict]":
+        """Search the mirror.
+
+        Every word of query must start a word of the mod's name or author, e.g. "miku v" matches
+        "Miku Voice Pack".
+
+        Params:
+            origin, author, category - only return mods with this origin, author or category (author is
+                                       compared case insensitively)
+            min_likes, min_downloads - only return mods with at least this many likes or downloads
+            sort - one of SORT_ORDERS
+            limit, offset - page of the results to return
+
+        Returns: a list of dicts with the keys name, id, author, category, origin, like_count,
+        download_count and date, like api.search_mods.
+        """
+        if sort not in SORT_ORDERS:
+            raise RuntimeError(f"unknown sort order {sort}")
+        where = ["mods.like_count >= ?", "mods.download_count >= ?"]
+        params = [min_likes, min_downloads]
+        match = _match_expression(query)
+        if match:
+            tables = "mods_fts JOIN mods ON mods.rowid = mods_fts.rowid"
+            where.append("mods_fts MATCH ?")
+            params.append(match)
+            order = SORT_ORDERS[sort] or "bm25(mods_fts)"
+        else:
+            tables = "mods"
+            order = SORT_ORDERS[sort] or "mods.date DESC"
+        for column, value in (("origin", origin), ("category", category)):
+            if value is not None:
+                where.append(f"mods.{column} = ?")
+                params.append(str(value))
+        if author is not None:
+            where.append("mods.author = ? COLLATE NOCASE")
+            params.append(author)
+        with self._lock, metrics.timed("catalog.search"):
+            rows = self._db.execute(
+                f"SELECT mods.* FROM {tables} WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def _match_expression(query: str) -> str:
+    """Turn user input into an FTS5 query matching every word as a prefix, without FTS5 operators."""
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def iter_search_pages(query: str, origin: str, catalog: ModCatalog = None, page_size: int = 50,
+                      sort: str = "relevance", author: str = None, category: str = None, min_likes: int = 0,
+                      min_downloads: int = 0):
+    """Search for mods from origin page by page, like api.iter_search_pages.
+
+    The mirror is searched if it has been synced for origin, the origin itself otherwise. The sort
+    order and filters (see ModCatalog.search) only apply to the mirror, online searches ignore them.
+    """
+    if catalog is None or catalog.last_synced(origin) is None:
+        return api.iter_search_pages(query, origin=origin)
+
+    def fetch_page(page):
+        results = catalog.search(query, origin=origin, author=author, category=category, min_likes=min_likes,
+                                 min_downloads=min_downloads, sort=sort, limit=page_size + 1,
+                                 offset=page * page_size)
+        return results[:page_size], len(results) > page_size
+
+    return api.iter_pages(fetch_page, prefetch=False)  # local queries are fast enough without it
+
+
+def sync_in_background(catalog: ModCatalog, max_age: float, log=print) -> threading.Thread:
+    """Sync the origins not synced in the last max_age seconds on a background thread.
+
+    Failures are only logged, searches keep using whatever the mirror has.
+
+    Params:
+        log - called with a message from the sync thread when the sync fails
+    """
+
+    def run():
+        try:
+            catalog.sync_if_stale(max_age)
+        except Exception as e:
+            log(f"Failed to sync the mod catalog: {e}")
+
+    thread = threading.Thread(target=run, name="d4m-catalog-sync", daemon=True)
+    thread.start()
+    return thread
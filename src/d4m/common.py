@@ -1,7 +1,8 @@
 import functools
 import packaging.version
 import pkg_resources
-import requests
+import d4m.metrics as metrics
+import d4m.net as net
 import vdf
 import os
 import toml
@@ -9,6 +10,8 @@ from sys import exit, platform
 
 MEGAMIX_APPID = 1761390
 
+GITHUB_API_DOMAIN = os.environ.get("D4M_GITHUB_API_DOMAIN", "https://api.github.com")
+
 VERSION = pkg_resources.get_distribution("d4m").version
 
 
@@ -56,11 +59,14 @@ def get_modloader_info(megamix_path: str):
 
 @functools.lru_cache(maxsize=None)
 def fetch_latest_d4m_version():
-    resp = requests.get(
-        f"https://api.github.com/repos/Brod8362/d4m/releases/latest"
+    resp = net.get(
+        f"{GITHUB_API_DOMAIN}/repos/Brod8362/d4m/releases/latest"
     )
     if resp.status_code != 200:
         raise RuntimeError(f"Github API returned {resp.status_code}")
     j = resp.json()
     return (packaging.version.Version(j["name"]),
             j["assets"][0]["browser_download_url"])  # TODO: don't make assumption about assets?
+
+
+metrics.register_lru_cache("fetch_latest_d4m_version", fetch_latest_d4m_version)
@@ -2,7 +2,6 @@ import os
 import toml
 import packaging.version
 import d4m.api as api
-import functools
 import json
 
 
@@ -75,31 +74,18 @@ class DivaSimpleMod:
     def can_attempt_dmm_migration(self) -> bool:
         return os.path.exists(os.path.join(self.path, "mod.json"))
 
-    def attempt_migrate_from_dmm(self) -> bool:
-        """Attempt to use dmm's mod.json file to get metadata."""
+    def dmm_gamebanana_id(self):
+        """Return the GameBanana id found in dmm's mod.json file, or None if there is none."""
         try:
             with open(os.path.join(self.path, "mod.json"), "r", encoding="UTF-8") as dmm_fd:
                 dmm_data = json.load(dmm_fd)
                 if "homepage" in dmm_data:
                     homepage = dmm_data["homepage"]
                     if "gamebanana" in homepage:
-                        potential_id = homepage.split("/")[-1]
-                        try:
-                            api.fetch_mod_data(potential_id, "Mod", origin="gamebanana") #TODO: maybe don't assume mod here?
-                            with open(os.path.join(self.path, "modinfo.toml"), "w", encoding="UTF-8") as d4m_fd:
-                                d4m_mod_data = {
-                                    "id": potential_id,
-                                    "hash": "no-hash",
-                                    "origin": "gamebanana",
-                                    "category": "Mod"
-                                }
-                                toml.dump(d4m_mod_data, d4m_fd)
-                                return True
-                        except:
-                            return False
+                        return homepage.split("/")[-1]
         except:
-            return False
-        return False
+            return None
+        return None
 
     def is_simple(self):
         return True
@@ -131,6 +117,12 @@ class DivaMod(DivaSimpleMod):
     def can_attempt_dmm_migration(self) -> bool:
         return False
 
-    @functools.cached_property
+    @property
     def modinfo(self):
-        return api.fetch_mod_data(self.id, self.category, origin=self.origin)
+        # cached by hand rather than with functools.cached_property, which before python 3.12 holds one
+        # lock for every instance and would stop lookups from different threads being batched together
+        try:
+            return self.__dict__["modinfo"]
+        except KeyError:
+            info = self.__dict__["modinfo"] = api.mod_data_loader.load(self.id, self.category, origin=self.origin)
+            return info
@@ -1,53 +1,74 @@
+import os
+from datetime import datetime
+
 import requests
 
-DMA_BASE_DOMAIN = "https://divamodarchive.com/api/v1"
+import d4m.net as net
+from d4m.cache import ModInfoCache
+from d4m.tracing import span
+
+DMA_BASE_DOMAIN = os.environ.get("D4M_DMA_BASE_DOMAIN", "https://divamodarchive.com/api/v1")
 DMA_SEARCH = "/posts/latest"
 DMA_GET_BY_ID = "/posts/"
 DMA_GET_BY_ID_BULK = "/posts/posts"
+DMA_FAVICON_URL = os.environ.get("D4M_DMA_FAVICON_URL", "https://divamodarchive.xyz/favicon.ico")
+DMA_MAX_POSTS_PER_REQUEST = 100
+DMA_CATALOG_PAGE_SIZE = 100
+DMA_SEARCH_PAGE_SIZE = 50
 
-mod_info_cache = {}
+mod_info_cache = ModInfoCache("dma.mod_info_cache")
 
 
 def multi_fetch_mod_data(mod_info: "list[tuple[int, str]]") -> "list[dict]":
-    mod_data = []
-    need_fetch = []
-    for (mod_id, _) in mod_info:
-        if mod_id in mod_info_cache:
-            mod_data.append(mod_info_cache[mod_id])
-        else:
-            need_fetch.append(mod_id)
-
-    if len(need_fetch) > 0:
-        resp = requests.get(
+    mod_ids = list(dict.fromkeys(mod_id for (mod_id, _) in mod_info))
+
+    def fetch(need_fetch):
+        mod_data = {}
+        for start in range(0, len(need_fetch), DMA_MAX_POSTS_PER_REQUEST):
+            mod_data.update(_fetch_chunk(need_fetch[start:start + DMA_MAX_POSTS_PER_REQUEST]))
+        return mod_data
+
+    found = mod_info_cache.fetch_many(mod_ids, fetch)
+    return [found[mod_id] for mod_id in mod_ids if mod_id in found]
+
+
+def _fetch_chunk(need_fetch: "list[int]") -> "dict":
+    """Returns: a dict of requested id -> post data, posts that were not found are left out."""
+    requested = {str(mod_id): mod_id for mod_id in need_fetch}  # the API always answers with int ids
+    mod_data = {}
+    with span("divamodarchive.fetch_chunk", count=len(need_fetch)):
+        resp = net.get(
             DMA_BASE_DOMAIN + DMA_GET_BY_ID_BULK,
-            params=[("post_id", i) for i in need_fetch]
+            params=[("post_id", i) for i in need_fetch],
+            hedge=net.METADATA_HEDGE_AFTER
         )
-        if resp.status_code // 100 != 2:
-            raise RuntimeError(f"DMA info returned {resp.status_code}")
-
-        j = resp.json()
-        for post in j:
-            obj = {
-                "id": post["id"],
-                "hash": post["date"],
-                "image": post["image"],
-                "download": post["link"],
-                "download_count": post["downloads"],
-                "like_count": post["likes"]
-            }
-            mod_info_cache[post["id"]] = obj
-            mod_data.append(obj)
+    if resp.status_code // 100 != 2:
+        raise RuntimeError(f"DMA info returned {resp.status_code}")
 
+    j = resp.json()
+    for post in j:
+        obj = {
+            "id": post["id"],
+            "hash": post["date"],
+            "image": post["image"],
+            "download": post["link"],
+            "download_count": post["downloads"],
+            "like_count": post["likes"]
+        }
+        mod_data[requested.get(str(post["id"]), post["id"])] = obj
     return mod_data
 
 
 # category is not used for diva mod archive
 def fetch_mod_data(mod_id: int, _category: str) -> "dict":
-    if mod_id in mod_info_cache:
-        return mod_info_cache[mod_id]
+    found = mod_info_cache.fetch_many([mod_id], lambda _: {mod_id: _fetch_single(mod_id)})
+    return found[mod_id]
+
 
-    resp = requests.get(
-        DMA_BASE_DOMAIN + DMA_GET_BY_ID + str(mod_id)
+def _fetch_single(mod_id: int) -> "dict":
+    resp = net.get(
+        DMA_BASE_DOMAIN + DMA_GET_BY_ID + str(mod_id),
+        hedge=net.METADATA_HEDGE_AFTER
     )
     if resp.status_code // 100 != 2:
         raise RuntimeError(f"DMA info returned {resp.status_code}")
@@ -62,20 +83,29 @@ def fetch_mod_data(mod_id: int, _category: str) -> "dict":
         "download_count": j["downloads"],
         "like_count": j["likes"]
     }
-    mod_info_cache[mod_id] = obj
     return obj
 
 
 def search_mods(query: str):
-    resp = requests.get(
+    return search_page(query, 0)[0]
+
+
+def search_page(query: str, page: int) -> "tuple[list[dict], bool]":
+    """Fetch a page of search results, pages start at 0.
+
+    Returns: the results, and whether there may be more pages.
+    """
+    resp = net.get(
         DMA_BASE_DOMAIN + DMA_SEARCH,
         params={
             "name": query,
-            "game_tag": 0
+            "game_tag": 0,
+            "offset": page * DMA_SEARCH_PAGE_SIZE,
+            "limit": DMA_SEARCH_PAGE_SIZE
         }
     )
     if resp.status_code == 404:
-        return []
+        return [], False
     if resp.status_code // 100 != 2:
         raise RuntimeError(f"DMA search API returned {resp.status_code}")
 
@@ -91,11 +121,51 @@ def search_mods(query: str):
         }
         return obj
 
-    return list(map(map_mod, j))
+    return list(map(map_mod, j)), len(j) >= DMA_SEARCH_PAGE_SIZE
+
+
+def fetch_catalog_page(page: int) -> "list[dict]":
+    """Fetch a page of every Diva mod, most recently modified first. Pages start at 0.
+
+    Returns: a list of dicts with the keys name, id, author, category, origin, like_count,
+    download_count and date (unix time of the last modification), empty past the last page.
+    """
+    resp = net.get(
+        DMA_BASE_DOMAIN + DMA_SEARCH,
+        params={
+            "name": "",
+            "game_tag": 0,
+            "offset": page * DMA_CATALOG_PAGE_SIZE,
+            "limit": DMA_CATALOG_PAGE_SIZE
+        }
+    )
+    if resp.status_code == 404:
+        return []
+    if resp.status_code // 100 != 2:
+        raise RuntimeError(f"DMA latest posts returned {resp.status_code}")
+
+    return [{
+        "name": post["name"],
+        "id": post["id"],
+        "author": post["user"]["name"],
+        "category": post["type_tag"],
+        "origin": "divamodarchive",
+        "like_count": post["likes"],
+        "download_count": post["downloads"],
+        "date": _parse_date(post["date"])
+    } for post in resp.json()]
+
+
+def _parse_date(date: str) -> float:
+    # fromisoformat only understands the Z suffix from Python 3.11 on
+    return datetime.fromisoformat(date.replace("Z", "+00:00")).timestamp()
 
 
 def download_favicon():
-    r = requests.get("https://divamodarchive.xyz/favicon.ico")
+    try:
+        r = net.get(DMA_FAVICON_URL, timeout=net.QUICK_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return None
     if r.status_code != 200:
         return None
     return r.content
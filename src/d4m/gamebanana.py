@@ -1,66 +1,84 @@
+import os
+
 import requests
+
+import d4m.net as net
+from d4m.cache import ModInfoCache
+from d4m.tracing import span
 from traceback import format_exc
 
-mod_info_cache = {}
+mod_info_cache = ModInfoCache("gamebanana.mod_info_cache")
 
-GB_BASE_DOMAIN = "https://api.gamebanana.com"
+GB_BASE_DOMAIN = os.environ.get("D4M_GB_BASE_DOMAIN", "https://api.gamebanana.com")
 GB_GET_DATA_ENDPOINT = "/Core/Item/Data"
 
-GB_ALT_API_DOMAIN = "https://gamebanana.com"
+GB_ALT_API_DOMAIN = os.environ.get("D4M_GB_ALT_API_DOMAIN", "https://gamebanana.com")
 GB_SEARCH_ENDPOINT = "/apiv9/Util/Game/Submissions"
+GB_MOD_INDEX_ENDPOINT = "/apiv11/Mod/Index"
+
+GB_FAVICON_URL = os.environ.get("D4M_GB_FAVICON_URL", "https://images.gamebanana.com/static/img/favicon/favicon.ico")
 
 GB_DIVA_GAME_ID = 16522
 
+GB_MAX_ITEMS_PER_REQUEST = 50
+GB_CATALOG_PAGE_SIZE = 50  # the largest page the mod index allows
+GB_SEARCH_PAGE_SIZE = 50
+
 
 def multi_fetch_mod_data(mod_info: "list[tuple[int, str]]") -> "list[dict]":
-    mod_data = []
-    need_fetch = []
-    for (mod_id, category) in mod_info:
-        if mod_id in mod_info_cache:
-            mod_data.append(mod_info_cache[mod_id])
-        else:
-            need_fetch.append((mod_id, category))
-
-    if len(need_fetch) > 0:
-        params = {}
-        for index, (mod_id, category) in enumerate(need_fetch):
-            params.update({
-                f"itemid[{index}]": mod_id,
-                f"fields[{index}]": "Files().aFiles(),Preview().sStructuredDataFullsizeUrl(),likes,downloads",
-                f"itemtype[{index}]": category
-            })
-
-        resp = requests.get(GB_BASE_DOMAIN + GB_GET_DATA_ENDPOINT, params=params)
-
-        if resp.status_code != 200:
-            raise RuntimeError(f"Gamebanana API returned {resp.status_code}")
-
-        for (index, elem) in enumerate(resp.json()):
-            mod_id = need_fetch[index][0]
-            try:
-                files = sorted(elem[0].values(), key=lambda x: x["_tsDateAdded"], reverse=True)
-                obj = {
-                    "id": mod_id,
-                    "hash": files[0]["_sMd5Checksum"],
-                    "image": elem[1],
-                    "download": files[0]["_sDownloadUrl"],
-                    "download_count": elem[3],
-                    "like_count": elem[2]
-                }
-                mod_info_cache[mod_id] = obj
-                mod_data.append(obj)
-            except:
-                obj = {
-                    "id": mod_id,
-                    "hash": "err",
-                    "image": "err",
-                    "download": "err",
-                    "download_count": "err",
-                    "like_count": "err",
-                    "error": format_exc()
-                }
-                mod_info_cache[mod_id] = obj
-                mod_data.append(obj)
+    categories = {mod_id: category for (mod_id, category) in mod_info}
+
+    def fetch(mod_ids):
+        need_fetch = [(mod_id, categories[mod_id]) for mod_id in mod_ids]
+        mod_data = {}
+        for start in range(0, len(need_fetch), GB_MAX_ITEMS_PER_REQUEST):
+            mod_data.update(_fetch_chunk(need_fetch[start:start + GB_MAX_ITEMS_PER_REQUEST]))
+        return mod_data
+
+    found = mod_info_cache.fetch_many(list(categories), fetch)
+    return [found[mod_id] for mod_id in categories if mod_id in found]
+
+
+def _fetch_chunk(need_fetch: "list[tuple[int, str]]") -> "dict":
+    mod_data = {}
+    params = {}
+    for index, (mod_id, category) in enumerate(need_fetch):
+        params.update({
+            f"itemid[{index}]": mod_id,
+            f"fields[{index}]": "Files().aFiles(),Preview().sStructuredDataFullsizeUrl(),likes,downloads",
+            f"itemtype[{index}]": category
+        })
+
+    with span("gamebanana.fetch_chunk", count=len(need_fetch)):
+        resp = net.get(GB_BASE_DOMAIN + GB_GET_DATA_ENDPOINT, params=params, hedge=net.METADATA_HEDGE_AFTER)
+
+    if resp.status_code != 200:
+        raise RuntimeError(f"Gamebanana API returned {resp.status_code}")
+
+    for (index, elem) in enumerate(resp.json()):
+        mod_id = need_fetch[index][0]
+        try:
+            files = sorted(elem[0].values(), key=lambda x: x["_tsDateAdded"], reverse=True)
+            obj = {
+                "id": mod_id,
+                "hash": files[0]["_sMd5Checksum"],
+                "image": elem[1],
+                "download": files[0]["_sDownloadUrl"],
+                "download_count": elem[3],
+                "like_count": elem[2]
+            }
+            mod_data[mod_id] = obj
+        except:
+            obj = {
+                "id": mod_id,
+                "hash": "err",
+                "image": "err",
+                "download": "err",
+                "download_count": "err",
+                "like_count": "err",
+                "error": format_exc()
+            }
+            mod_data[mod_id] = obj
     return mod_data
 
 
@@ -68,22 +86,29 @@ def fetch_mod_data(mod_id: int, category: str) -> "dict":
     """
     dict w/ keys id, hash, download
     """
-    if mod_id in mod_info_cache:
-        return mod_info_cache[mod_id]
     return multi_fetch_mod_data([(mod_id, category)])[0]
 
 
 def search_mods(query: str):
-    resp = requests.get(
+    return search_page(query, 0)[0]
+
+
+def search_page(query: str, page: int) -> "tuple[list[dict], bool]":
+    """Fetch a page of search results, pages start at 0.
+
+    Returns: the results, and whether there may be more pages.
+    """
+    resp = net.get(
         GB_ALT_API_DOMAIN + GB_SEARCH_ENDPOINT,
         params={
             "_idGameRow": GB_DIVA_GAME_ID,
             "_sName": query,
-            "_nPerpage": 50
+            "_nPage": page + 1,
+            "_nPerpage": GB_SEARCH_PAGE_SIZE
         }
     )
     if resp.status_code == 404:
-        return []
+        return [], False
     if resp.status_code != 200:
         raise RuntimeError(f"Gamebanana search API returned {resp.status_code}")
 
@@ -99,11 +124,46 @@ def search_mods(query: str):
         }
         return obj
 
-    return list(map(map_mod, j))
+    return list(map(map_mod, j)), len(j) >= GB_SEARCH_PAGE_SIZE
+
+
+def fetch_catalog_page(page: int) -> "list[dict]":
+    """Fetch a page of every Diva mod, most recently modified first. Pages start at 0.
+
+    Returns: a list of dicts with the keys name, id, author, category, origin, like_count,
+    download_count and date (unix time of the last modification), empty past the last page.
+    """
+    resp = net.get(
+        GB_ALT_API_DOMAIN + GB_MOD_INDEX_ENDPOINT,
+        params={
+            "_nPage": page + 1,
+            "_nPerpage": GB_CATALOG_PAGE_SIZE,
+            "_aFilters[Generic_Game]": GB_DIVA_GAME_ID,
+            "_sSort": "Generic_LatestModified"
+        }
+    )
+    if resp.status_code == 404:
+        return []
+    if resp.status_code != 200:
+        raise RuntimeError(f"Gamebanana mod index returned {resp.status_code}")
+
+    return [{
+        "name": record["_sName"],
+        "id": record["_idRow"],
+        "author": record["_aSubmitter"]["_sName"],
+        "category": record["_sModelName"],
+        "origin": "gamebanana",
+        "like_count": record.get("_nLikeCount", 0),
+        "download_count": record.get("_nDownloadCount", 0),
+        "date": record.get("_tsDateModified") or record.get("_tsDateAdded", 0)
+    } for record in resp.json().get("_aRecords", [])]
 
 
 def download_favicon():
-    r = requests.get("https://images.gamebanana.com/static/img/favicon/favicon.ico")
+    try:
+        r = net.get(GB_FAVICON_URL, timeout=net.QUICK_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return None
     if r.status_code != 200:
         return None
     return r.content
@@ -8,6 +8,13 @@ CONFIG_PATH = os.path.join(appdirs.user_config_dir(), "d4m.toml")
 CONFIG_OPTIONS = [
     ("last_d4m_update_check", 0),
     ("last_dmm_update_check", 0),
+    ("update_generations_kept", 1),  # previous versions kept after updating a mod, for rollback
+    ("prefetch_updates", False),  # download updates in the background after checking for them
+    ("prefetch_bandwidth_limit_kb", 0),  # KiB/s, 0 for no limit
+    ("prefetch_quota_mb", 2048),
+    ("catalog_search", False),  # search a local mirror of every origin's mods instead of searching online
+    ("catalog_sync_hours", 12),  # how old the mirror can get before it is synced again
+    ("hedge_metadata_after_ms", 0),  # send a second mod metadata request if the first is this slow, 0 to never
 ]
 
 
@@ -3,7 +3,9 @@ import functools
 import os
 import subprocess
 import sys
+import threading
 import time
+from collections import OrderedDict
 from importlib.resources import files
 from sys import platform
 from time import strftime
@@ -13,13 +15,19 @@ import PySide6.QtConcurrent
 import PySide6.QtCore
 import PySide6.QtWidgets as qwidgets
 import d4m.api
+import d4m.catalog
 import d4m.common
 import d4m.manage
+import d4m.metrics
+import d4m.net
 import packaging.version
 import requests.exceptions
 from PySide6.QtGui import QAction, QColor, QDesktopServices, QImage, QPixmap
 from d4m.global_config import D4mConfig
 from d4m.manage import ModManager
+from d4m.modindex import ModIndex
+from d4m.profiling import profiling_requested, session_profiler, start_session_profile
+from d4m.tracing import span
 
 if os.name == "nt":  # windows hack for svg because pyinstaller isn't cooperating
     with open(os.path.join(os.path.expandvars("%ProgramFiles(x86)%"), "d4m", "logo.svg"), "rb") as fd:
@@ -28,6 +36,15 @@ else:
     D4M_ICON_DATA = files("d4m.res").joinpath("logo.svg").read_bytes()
 
 LOG_HISTORY = []
+_install_pool = None
+_detached_jobs = set()  # InstallJobs still running after their dialog was closed
+
+MAX_PARALLEL_INSTALLS = 3
+THUMBNAIL_SIZE = 128
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+THUMBNAIL_PREFETCH_ROWS = 10  # rows above and below the visible ones whose thumbnails are decoded too
+# mod table column -> ModIndex sort key, clicking any other column goes back to priority order
+SORT_COLUMNS = {1: "name", 2: "enabled", 3: "author", 4: "out_of_date", 5: "origin", 6: "size"}
 
 FAVICONS = {
     "divamodarchive": d4m.api.download_favicon("divamodarchive"),
@@ -49,6 +66,9 @@ def favicon_qimage(origin):
         return None
 
 
+d4m.metrics.register_lru_cache("favicon_qimage", favicon_qimage)
+
+
 def log_msg(content: str):
     timestamp = strftime("%H:%M:%S")
     LOG_HISTORY.append(f"[{timestamp}] {content}")
@@ -84,8 +104,8 @@ def on_dml_toggle_click(status_label, mod_manager: ModManager):
         status_label.setText("ENABLED")
 
 
-def on_install_mod(_, mod_manager: ModManager, callback):
-    dialog = ModInstallDialog(mod_manager=mod_manager, callback=callback)
+def on_install_mod(_, mod_manager: ModManager, callback, catalog=None):
+    dialog = ModInstallDialog(mod_manager=mod_manager, callback=callback, catalog=catalog)
     dialog.exec()
 
 
@@ -117,6 +137,18 @@ def on_update_mod(selections, mod_manager: ModManager):
     log_msg(f"Updated {updated} mods")
 
 
+def on_rollback_mod(selections, mod_manager: ModManager):
+    for mod in selections:
+        if mod_manager.can_rollback(mod):
+            try:
+                restored = mod_manager.rollback(mod)
+                log_msg(f"Rolled back {mod.name} to {restored}")
+            except Exception as e:
+                log_msg(f"Failed to roll back {mod.name}: {e}")
+        else:
+            log_msg(f"{mod} has no previous version to roll back to.")
+
+
 def on_delete_mod(selections, mod_manager: ModManager):
     content = f"Are you sure you want to delete <strong>{len(selections)}</strong> mod(s)?\n" + ", ".join(
         map(lambda x: x.name, selections))
@@ -191,6 +223,11 @@ def show_log(parent):
     dialog.show()
 
 
+def show_statistics(parent):
+    dialog = StatisticsDialog(parent=parent)
+    dialog.show()
+
+
 def show_about(parent):
     about_str = f"""
     d4m v{d4m.common.VERSION}
@@ -202,6 +239,17 @@ def show_about(parent):
     qwidgets.QMessageBox.about(parent, "About d4m", about_str)
 
 
+def on_toggle_profiling(action: QAction):
+    if session_profiler.running:
+        pstats_path, collapsed_path = session_profiler.stop()
+        log_msg(f"Profile written to {pstats_path} and {collapsed_path}")
+        show_d4m_infobox(f"Profile written to:\n{pstats_path}\n{collapsed_path}")
+    else:
+        start_session_profile()
+        log_msg("Profiling started")
+    action.setText("Stop Profiling" if session_profiler.running else "Start Profiling")
+
+
 def on_increase_priority(selected, mod_manager: ModManager) -> int:
     return generic_priority_shift(selected[0], mod_manager, -1)
 
@@ -211,13 +259,7 @@ def on_decrease_priority(selected, mod_manager: ModManager) -> int:
 
 
 def generic_priority_shift(mod, mod_manager, shift):
-    if (mod_idx := mod_manager.mods.index(mod)) != -1:
-        if 0 <= mod_idx + shift <= len(mod_manager.mods):
-            t = mod_manager.mods[mod_idx]
-            mod_manager.mods[mod_idx] = mod_manager.mods[mod_idx + shift]
-            mod_manager.mods[mod_idx + shift] = t
-            mod_manager.save_priority()
-            return mod_idx + shift
+    return mod_manager.shift_priority(mod, shift)
 
 
 ######################
@@ -246,6 +288,37 @@ class LogDialog(qwidgets.QDialog):
         self.log_widget.setText("\n".join(LOG_HISTORY))
 
 
+class StatisticsDialog(qwidgets.QDialog):
+    def __init__(self, parent=None):
+        super(StatisticsDialog, self).__init__(parent)
+        self.stats_widget = qwidgets.QTextEdit()
+        self.stats_widget.setReadOnly(True)
+        refresh_button = qwidgets.QPushButton("Refresh")
+        refresh_button.clicked.connect(self.render_stats)
+        save_button = qwidgets.QPushButton("Save as JSON...")
+        save_button.clicked.connect(self.save_json)
+        button_row = qwidgets.QHBoxLayout()
+        button_row.addWidget(refresh_button)
+        button_row.addWidget(save_button)
+        self.layout = qwidgets.QVBoxLayout()
+        self.layout.addWidget(self.stats_widget)
+        self.layout.addLayout(button_row)
+        self.setLayout(self.layout)
+        self.setWindowFlag(PySide6.QtCore.Qt.Tool)
+        self.setWindowTitle("d4m statistics")
+        self.setMinimumSize(500, 300)
+        self.render_stats()
+
+    def render_stats(self):
+        self.stats_widget.setText(d4m.metrics.format_report())
+
+    def save_json(self):
+        path, _ = qwidgets.QFileDialog.getSaveFileName(self, "Save statistics", "d4m-statistics.json", "JSON (*.json)")
+        if path:
+            d4m.metrics.dump_json(path)
+            log_msg(f"Statistics saved to {path}")
+
+
 class DmmMigrateDialog(qwidgets.QDialog):
     def __init__(self, mod_manager=None, callback=None, parent=None):
         super(DmmMigrateDialog, self).__init__(parent)
@@ -255,26 +328,25 @@ class DmmMigrateDialog(qwidgets.QDialog):
         self.progress_bar = qwidgets.QProgressBar()
         self.start_button = qwidgets.QPushButton("Start")
 
+        def on_result(mod, success):
+            if success:
+                self.progress_log.append(f"Migrated {mod.name} successfully.\n")
+            else:
+                self.progress_log.append(f"Failed to migrate {mod.name}.\n")
+            self.progress_bar.setValue(self.progress_bar.value() + 1)
+
         def migrate():
-            eligible = [m for m in mod_manager.mods if m.can_attempt_dmm_migration()]
-            successful_count = 0
+            eligible = mod_manager.dmm_migration_candidates()
             self.progress_bar.setRange(0, len(eligible))
+            self.progress_bar.setValue(0)
             self.progress_log.append(f"{len(eligible)} mod(s) are eligible for migration\n")
-            for (index, mod) in enumerate(eligible):
-                if mod.can_attempt_dmm_migration():
-                    self.progress_log.append(f"Attempting to migrate {mod.name}...\n")
-                    success = mod.attempt_migrate_from_dmm()
-                    if success:
-                        self.progress_log.append(f"Migrated {mod.name} successfully.\n")
-                        successful_count += 1
-                    else:
-                        self.progress_log.append(f"Failed to migrate {mod.name}.\n")
-                    self.progress_bar.setValue(index + 1)
+            migrated, failed = mod_manager.migrate_from_dmm(on_result=on_result)
 
             self.progress_bar.setRange(0, 1)
             self.progress_bar.setValue(1)
+            successful_count = len(migrated)
             if successful_count > 0:
-                self.progress_log.append(f"Migrated {successful_count}/{len(eligible)} successfully.\n")
+                self.progress_log.append(f"Migrated {successful_count}/{successful_count + len(failed)} successfully.\n")
                 self.progress_log.append(
                     f"Please note that migrated mod(s) may need an update before the thumbnail appears.\n")
             if callback:
@@ -293,7 +365,7 @@ class DmmMigrateDialog(qwidgets.QDialog):
 
 
 class ModInstallDialog(qwidgets.QDialog):
-    def __init__(self, mod_manager=None, callback=None, parent=None):
+    def __init__(self, mod_manager=None, callback=None, catalog=None, parent=None):
         super(ModInstallDialog, self).__init__(parent)
 
         self.win_layout = qwidgets.QVBoxLayout()
@@ -315,68 +387,61 @@ class ModInstallDialog(qwidgets.QDialog):
         self.checkbox_layout.addWidget(self.checkbox_search_dma)
         self.checkbox_layout.addWidget(self.checkbox_search_gb)
 
+        # sort order and filters of the catalog mirror, only shown when searches use it
+        self.filter_layout = qwidgets.QHBoxLayout()
+        self.sort_input = qwidgets.QComboBox()
+        self.sort_input.addItems(list(d4m.catalog.SORT_ORDERS))
+        self.author_input = qwidgets.QLineEdit("")
+        self.author_input.setPlaceholderText("Author")
+        self.min_likes_input = qwidgets.QSpinBox()
+        self.min_likes_input.setRange(0, 10 ** 6)
+        self.min_likes_input.setPrefix("Min. likes: ")
+        self.min_downloads_input = qwidgets.QSpinBox()
+        self.min_downloads_input.setRange(0, 10 ** 9)
+        self.min_downloads_input.setPrefix("Min. downloads: ")
+        self.filter_layout.addWidget(qwidgets.QLabel("Sort by"))
+        self.filter_layout.addWidget(self.sort_input)
+        self.filter_layout.addWidget(self.author_input)
+        self.filter_layout.addWidget(self.min_likes_input)
+        self.filter_layout.addWidget(self.min_downloads_input)
+
         self.search_button = qwidgets.QPushButton("Search")
         self.found_mod_list = qwidgets.QTableWidget()
 
-        def on_install_click(results):
-            self.install_button.setEnabled(False)
-            self.search_button.setEnabled(False)
-            selected_rows = set(map(lambda x: x.row(), self.found_mod_list.selectedIndexes()))
-            selected_ids = list(map(lambda i: results[i], selected_rows))
-            self.progress_bar.setRange(0, len(selected_ids))
-            self.progress_bar.setValue(0)
-            self.status_label.setText(f"Preparing to install {len(selected_ids)} mod(s)")
-            success = 0
-            for index, mod_info in enumerate(selected_ids):
-                text = f"<strong>{index + 1}/{len(selected_ids)}... Installing mod {mod_info['name']} "
-                self.status_label.setText(text)
-                if not mod_manager.mod_is_installed(mod_info["id"], origin=mod_info["origin"]):
-                    try:
-                        mod_manager.install_mod(mod_info["id"], mod_info["category"], fetch_thumbnail=True,
-                                                origin=mod_info["origin"])
-                        success += 1
-                    except Exception as e:
-                        print_exc()
-                        r = f"Failed to install {mod_info['origin']}: {e}"
-                        self.status_label.setText(text)
-                        log_msg(r)
-                    self.progress_bar.setValue(index + 1)
-            # when all is done
-            if success == len(selected_ids):
-                self.status_label.setText(f"Installed {success} mod(s) successfully.")
-            else:
-                self.status_label.setText(f"Installed {success} mod(s) ({len(selected_ids) - success} errors)")
-            self.search_button.setEnabled(True)
-            self.install_button.setEnabled(True)
+        self.cancel_button = qwidgets.QPushButton("Cancel Installs")
+        self.cancel_button.setEnabled(False)
+        self.mod_manager = mod_manager
+        self.results = []
+        self.result_rows = {}  # (origin, str(id)) -> row of the mod in found_mod_list
+        self.jobs = {}  # (origin, str(id)) -> InstallJob still running
+        self.job_progress = {}  # (origin, str(id)) -> share of the job done, 0 to 1
+        self.installed_count = 0
+        self.failed_count = 0
+        self.callback = callback
+
+        self.pagers = {}  # origin -> search result generator, for the origins that may have more results
+        self.search_errors = {}  # origin -> error of its last page
+        self.loading_results = False
 
         def populate_search_results():
-            try:
-                results = []
-                self.progress_bar.setRange(0, 5)
-                self.progress_bar.setValue(1)
-
-                if self.checkbox_search_gb.isChecked():
-                    gb_results = d4m.api.search_mods(self.mod_name_input.text(), origin="gamebanana")
-                    results.extend(gb_results)
-                    self.progress_bar.setValue(2)
-                    d4m.api.multi_fetch_mod_data([(x["id"], x["category"]) for x in gb_results], origin="gamebanana")
-
-                if self.checkbox_search_dma.isChecked():
-                    self.progress_bar.setValue(3)
-                    dma_results = d4m.api.search_mods(self.mod_name_input.text(), origin="divamodarchive")
-                    results.extend(dma_results)
-                    self.progress_bar.setValue(4)
-                    d4m.api.multi_fetch_mod_data([(x["id"], x["category"]) for x in dma_results],
-                                                 origin="divamodarchive")
-
-            except RuntimeError as e:
-                self.status_label.setText(f"Err: <strong color=red>{e}</strong>")
-                return
-            finally:
-                self.progress_bar.setValue(5)
-
-            self.status_label.setText(
-                f"Found <strong>{len(results)}</strong> mod(s) matching <em>{self.mod_name_input.text()}</em>")
+            for pager in self.pagers.values():
+                pager.close()
+            self.pagers = {}
+            self.search_errors = {}
+            filters = {
+                "sort": self.sort_input.currentText(),
+                "author": self.author_input.text().strip() or None,
+                "min_likes": self.min_likes_input.value(),
+                "min_downloads": self.min_downloads_input.value()
+            }
+            if self.checkbox_search_gb.isChecked():
+                self.pagers["gamebanana"] = d4m.catalog.iter_search_pages(self.mod_name_input.text(), "gamebanana",
+                                                                          catalog, **filters)
+            if self.checkbox_search_dma.isChecked():
+                self.pagers["divamodarchive"] = d4m.catalog.iter_search_pages(self.mod_name_input.text(),
+                                                                              "divamodarchive", catalog, **filters)
+            self.results = []
+            self.result_rows = {}
             self.found_mod_list.clear()
             self.found_mod_list.setColumnCount(5)
             self.found_mod_list.setHorizontalHeaderLabels(["Mod", "Author", "Mod ID", "Info", "Status"])
@@ -385,10 +450,50 @@ class ModInstallDialog(qwidgets.QDialog):
             self.found_mod_list.setEditTriggers(qwidgets.QAbstractItemView.NoEditTriggers)
             self.found_mod_list.setSelectionBehavior(qwidgets.QAbstractItemView.SelectionBehavior.SelectRows)
             self.found_mod_list.horizontalHeader().setStretchLastSection(True)
-            self.found_mod_list.setRowCount(len(results))
-            for index, mod_info in enumerate(results):
-                detailed_mod_info = d4m.api.fetch_mod_data(mod_info["id"], mod_info["category"], origin=mod_info[
-                    "origin"])  # should already be fetched and cached, no performance concerns here
+            self.found_mod_list.setRowCount(0)
+            load_more_results()
+
+        def load_more_results():
+            """Fetch the next page of every origin that may have more results, and append them."""
+            if not self.pagers or self.loading_results:
+                return
+            self.loading_results = True
+            try:
+                results = []
+                self.progress_bar.setRange(0, len(self.pagers) + 2)
+                self.progress_bar.setValue(1)
+                pages, errors = d4m.api.next_pages(self.pagers)
+                self.progress_bar.setValue(2)
+                for origin in errors:  # a late pager may still be running, it is left alone
+                    del self.pagers[origin]
+                self.search_errors.update(errors)
+                for origin, page in pages.items():
+                    if page is None:
+                        del self.pagers[origin]
+                        continue
+                    results.extend(page)
+                    uncounted = [x for x in page if "like_count" not in x]
+                    if uncounted:
+                        d4m.api.multi_fetch_mod_data([(x["id"], x["category"]) for x in uncounted],
+                                                     origin=uncounted[0]["origin"])
+                    self.progress_bar.setValue(self.progress_bar.value() + 1)
+            except RuntimeError as e:
+                self.status_label.setText(f"Err: <strong color=red>{e}</strong>")
+                self.pagers = {}
+                return
+            finally:
+                self.progress_bar.setValue(self.progress_bar.maximum())
+                self.loading_results = False
+
+            first_row = len(self.results)
+            self.found_mod_list.setRowCount(first_row + len(results))
+            mod_manager.annotate_installed(results)
+            for index, mod_info in enumerate(results, start=first_row):
+                if "like_count" in mod_info:  # from the catalog mirror, which has the counts already
+                    detailed_mod_info = mod_info
+                else:
+                    detailed_mod_info = d4m.api.fetch_mod_data(mod_info["id"], mod_info["category"], origin=mod_info[
+                        "origin"])  # should already be fetched and cached, no performance concerns here
                 mod_label = qwidgets.QTableWidgetItem(mod_info["name"])
                 mod_label.setToolTip(mod_info["name"])
                 mod_author_label = qwidgets.QTableWidgetItem(mod_info["author"])
@@ -400,9 +505,9 @@ class ModInstallDialog(qwidgets.QDialog):
                     mod_id_label.setData(PySide6.QtCore.Qt.DecorationRole, fav)
 
                 status = "Available"
-                if mod_manager.mod_is_installed(mod_info["id"], origin=mod_info["origin"]):
+                if mod_info["installed"]:
                     status = "Installed"
-                if detailed_mod_info["hash"] == "err":
+                if detailed_mod_info.get("hash") == "err":
                     status = "Unavailable (Error)"
                 mod_installed_label = qwidgets.QTableWidgetItem(status)
                 mod_info_label = qwidgets.QTableWidgetItem(
@@ -412,47 +517,279 @@ class ModInstallDialog(qwidgets.QDialog):
                 self.found_mod_list.setItem(index, 2, mod_id_label)
                 self.found_mod_list.setItem(index, 3, mod_info_label)
                 self.found_mod_list.setItem(index, 4, mod_installed_label)
-            if len(results) > 0:
-                self.install_button.setEnabled(True)
-                self.install_button.clicked.connect(lambda *_: on_install_click(results))
+            self.results.extend(results)
+            self.result_rows.update({(mod_info["origin"], str(mod_info["id"])): index
+                                     for index, mod_info in enumerate(results, start=first_row)})
+            more = " (scroll down for more)" if self.pagers else ""
+            failed = "".join(f"<br>Err ({origin}): <strong color=red>{e}</strong>"
+                             for origin, e in self.search_errors.items())
+            self.status_label.setText(
+                f"Found <strong>{len(self.results)}</strong> mod(s) matching <em>{self.mod_name_input.text()}</em>{more}"
+                f"{failed}")
+            self.install_button.setEnabled(len(self.results) > 0)
+
+        def on_results_scrolled(value: int):
+            scroll_bar = self.found_mod_list.verticalScrollBar()
+            if value >= scroll_bar.maximum() - scroll_bar.pageStep() // 4:
+                load_more_results()
 
         # Populate user interactable fields
         self.search_layout.addWidget(self.mod_name_input)
         self.search_layout.addWidget(self.search_button)
         self.search_button.clicked.connect(populate_search_results)
+        self.found_mod_list.verticalScrollBar().valueChanged.connect(on_results_scrolled)
+        self.install_button.clicked.connect(self.start_installs)
+        self.cancel_button.clicked.connect(self.cancel_installs)
 
         # Populate main layout
         self.win_layout.addLayout(self.search_layout)
         self.win_layout.addLayout(self.checkbox_layout)
+        if catalog is not None:
+            self.win_layout.addLayout(self.filter_layout)
         self.win_layout.addWidget(self.found_mod_list)
         self.win_layout.addWidget(self.status_label)
         self.win_layout.addWidget(self.progress_bar)
-        self.win_layout.addWidget(self.install_button)
+        install_buttons = qwidgets.QHBoxLayout()
+        install_buttons.addWidget(self.install_button)
+        install_buttons.addWidget(self.cancel_button)
+        self.win_layout.addLayout(install_buttons)
 
         self.setLayout(self.win_layout)
         self.setMinimumSize(650, 350)
         self.setWindowTitle("d4m - Install new mods")
 
+    def start_installs(self):
+        selected_rows = sorted(set(map(lambda x: x.row(), self.found_mod_list.selectedIndexes())))
+        if not self.jobs:
+            self.installed_count = 0
+            self.failed_count = 0
+        started = 0
+        for row in selected_rows:
+            mod_info = self.results[row]
+            key = (mod_info["origin"], str(mod_info["id"]))
+            if key in self.jobs or self.mod_manager.mod_is_installed(mod_info["id"], origin=mod_info["origin"]):
+                continue
+            job = InstallJob(self.mod_manager, mod_info)
+            job.signals.downloaded.connect(self.on_job_downloaded)
+            job.signals.extracted.connect(self.on_job_extracted)
+            job.signals.finished.connect(self.on_job_finished)
+            self.jobs[key] = job
+            self.job_progress[key] = 0
+            self.set_row_status(key, "Queued")
+            install_pool().start(job)
+            started += 1
+        if started:
+            self.cancel_button.setEnabled(True)
+            self.update_progress()
+
+    def cancel_installs(self):
+        for job in self.jobs.values():
+            job.cancel()
+        self.status_label.setText("Cancelling...")
+
+    def set_row_status(self, key, status: str):
+        row = self.result_rows.get(key)
+        if row is not None and self.results[row]["origin"] == key[0] and str(self.results[row]["id"]) == key[1]:
+            self.found_mod_list.setItem(row, 4, qwidgets.QTableWidgetItem(status))
+
+    def on_job_downloaded(self, mod_info, received: int, total: int):
+        key = (mod_info["origin"], str(mod_info["id"]))
+        if total > 0:
+            self.job_progress[key] = 0.8 * received / total  # the download is most of the work
+            self.set_row_status(key, f"Downloading {received / (1024 * 1024):.1f}/{total / (1024 * 1024):.1f}Mb")
+        else:
+            self.set_row_status(key, f"Downloading {received / (1024 * 1024):.1f}Mb")
+        self.update_progress()
+
+    def on_job_extracted(self, mod_info, entries: int, extracted: int, total: int):
+        key = (mod_info["origin"], str(mod_info["id"]))
+        self.job_progress[key] = 0.8 + (0.2 * extracted / total if total > 0 else 0)
+        self.set_row_status(key, f"Extracting ({entries} files)")
+        self.update_progress()
+
+    def on_job_finished(self, mod_info, error: str):
+        key = (mod_info["origin"], str(mod_info["id"]))
+        job = self.jobs.pop(key)
+        self.job_progress.pop(key)
+        if not error:
+            self.installed_count += 1
+            self.set_row_status(key, "Installed")
+        elif job.cancelled.is_set():
+            self.set_row_status(key, "Cancelled")
+        else:
+            self.failed_count += 1
+            self.set_row_status(key, "Failed")
+            log_msg(f"Failed to install {mod_info['name']}: {error}")
+        self.update_progress()
+
+    def update_progress(self):
+        if self.jobs:
+            self.progress_bar.setRange(0, 1000)
+            self.progress_bar.setValue(int(1000 * sum(self.job_progress.values()) / len(self.job_progress)))
+            self.status_label.setText(f"Installing {len(self.jobs)} mod(s)...")
+        else:
+            self.progress_bar.setRange(0, 1)
+            self.progress_bar.setValue(1)
+            self.cancel_button.setEnabled(False)
+            if self.failed_count:
+                self.status_label.setText(f"Installed {self.installed_count} mod(s) ({self.failed_count} errors)")
+            else:
+                self.status_label.setText(f"Installed {self.installed_count} mod(s) successfully.")
+
+    def done(self, result):
+        # installs that have not finished are cancelled. A job may be past the point where it can stop, it is
+        # left to finish in the background and the mod list is refreshed if it still installed its mod.
+        self.cancel_installs()
+        for job in self.jobs.values():
+            job.signals.downloaded.disconnect(self.on_job_downloaded)
+            job.signals.extracted.disconnect(self.on_job_extracted)
+            job.signals.finished.disconnect(self.on_job_finished)
+            _detached_jobs.add(job)
+            job.signals.finished.connect(functools.partial(on_detached_job_finished, job, self.callback))
+        self.jobs = {}
+        for pager in self.pagers.values():  # stops their prefetching
+            pager.close()
+        self.pagers = {}
+        super(ModInstallDialog, self).done(result)
+
+
+def install_pool() -> PySide6.QtCore.QThreadPool:
+    """Return the pool shared by every install dialog, so no more than MAX_PARALLEL_INSTALLS run at once."""
+    global _install_pool
+    if _install_pool is None:
+        _install_pool = PySide6.QtCore.QThreadPool()
+        _install_pool.setMaxThreadCount(MAX_PARALLEL_INSTALLS)
+    return _install_pool
+
+
+def on_detached_job_finished(job, callback, mod_info, error: str):
+    _detached_jobs.discard(job)
+    if not error:
+        log_msg(f"Installed {mod_info['name']}")
+        if callback:
+            callback()
+
+
+class InstallJobSignals(PySide6.QtCore.QObject):
+    downloaded = PySide6.QtCore.Signal(object, int, int)  # mod info, bytes received, total bytes
+    extracted = PySide6.QtCore.Signal(object, int, int, int)  # mod info, entries, bytes extracted, total bytes
+    finished = PySide6.QtCore.Signal(object, str)  # mod info, error message (empty on success)
+
+
+class InstallJob(PySide6.QtCore.QRunnable):
+    """Installs one mod from search results in the background, reporting progress through signals."""
+
+    def __init__(self, mod_manager: ModManager, mod_info: dict):
+        super(InstallJob, self).__init__()
+        self.setAutoDelete(False)  # the dialog keeps jobs until they report back
+        self.mod_manager = mod_manager
+        self.mod_info = mod_info
+        self.signals = InstallJobSignals()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        mod_info = self.mod_info
+        try:
+            if self.cancelled.is_set():
+                raise d4m.api.OperationCancelled("install cancelled")
+            self.mod_manager.install_mod(
+                mod_info["id"], mod_info["category"], fetch_thumbnail=True, origin=mod_info["origin"],
+                download_progress=lambda received, total: self.signals.downloaded.emit(mod_info, received, total),
+                extract_progress=lambda entries, extracted, total: self.signals.extracted.emit(mod_info, entries,
+                                                                                              extracted, total),
+                cancelled=self.cancelled)
+            self.signals.finished.emit(mod_info, "")
+        except Exception as e:
+            if not self.cancelled.is_set():
+                print_exc()
+            self.signals.finished.emit(mod_info, str(e) or type(e).__name__)
+
+
+class ThumbnailCache:
+    """LRU of decoded thumbnails keyed by (path, mtime), bounded by the memory the images use."""
+
+    def __init__(self, max_bytes: int = THUMBNAIL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._images = OrderedDict()
+
+    def get(self, key):
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def put(self, key, image: QImage):
+        if key in self._images:
+            self.used_bytes -= self._images.pop(key).sizeInBytes()
+        self._images[key] = image
+        self.used_bytes += image.sizeInBytes()
+        while self.used_bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self.used_bytes -= evicted.sizeInBytes()
+
+
+class ThumbnailDecodeSignals(PySide6.QtCore.QObject):
+    decoded = PySide6.QtCore.Signal(object, object)  # (path, mtime), scaled QImage
+
+
+class ThumbnailDecodeJob(PySide6.QtCore.QRunnable):
+    """Loads and scales a thumbnail off the UI thread. QImage, unlike QPixmap, is safe to use from any thread."""
+
+    def __init__(self, key, signals: ThumbnailDecodeSignals):
+        super(ThumbnailDecodeJob, self).__init__()
+        self.key = key
+        self.signals = signals
+
+    def run(self):
+        path, _ = self.key
+        with span("gui.load_thumbnail", path=path):
+            base = QImage()
+            base.load(path)
+            image = base.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                aspectMode=PySide6.QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        self.signals.decoded.emit(self.key, image)
+
+
+class TrashSignals(PySide6.QtCore.QObject):
+    emptied = PySide6.QtCore.Signal(object)  # bytes removed from the trash so far
+
+
+class LogSignals(PySide6.QtCore.QObject):
+    message = PySide6.QtCore.Signal(str)  # passed to log_msg on the UI thread
+
+
+class UpdateCheckSignals(PySide6.QtCore.QObject):
+    mod_checked = PySide6.QtCore.Signal(object, str)  # mod, error message (empty if the check succeeded)
+    thumbnail_ready = PySide6.QtCore.Signal(object)  # mod whose thumbnail was downloaded
+    finished = PySide6.QtCore.Signal(str)  # error message (empty if every origin was checked)
+
 
 class BackgroundUpdateWorker(PySide6.QtCore.QRunnable):
-    def __init__(self, mod_manager, populate_func, parent=None, on_complete=None):
+    """Checks for updates in the background, reporting every mod through signals as soon as it is known."""
+
+    def __init__(self, mod_manager, parent=None):
         super(BackgroundUpdateWorker, self).__init__(parent)
+        self.setAutoDelete(False)
         self.updates_ready = False
         self.mod_manager = mod_manager
-        self.populate = populate_func
-        self.on_complete = on_complete
+        self.signals = UpdateCheckSignals()
 
     def run(self):
         log_msg("Checking for updates...")
+        error = ""
         try:
-            self.mod_manager.check_for_updates(get_thumbnails=True)
-            self.populate(update_check=True)
-            log_msg("Update check complete.")
+            self.mod_manager.check_for_updates(
+                get_thumbnails=True,
+                on_result=lambda mod, e: self.signals.mod_checked.emit(mod, str(e) if e is not None else ""),
+                on_thumbnail=self.signals.thumbnail_ready.emit)
         except Exception as e:
-            log_msg(f"Update check failed: {e}")
+            error = str(e) or type(e).__name__
         self.updates_ready = True
-        if self.on_complete:
-            self.on_complete()
+        self.signals.finished.emit(error)
 
 
 class VoidFuncBackgroundWorker(PySide6.QtCore.QRunnable):
@@ -505,6 +842,9 @@ class D4mGUI:
         mod_table_and_buttons_layout = qwidgets.QHBoxLayout()
         mod_table = qwidgets.QTableWidget()
         mod_table_and_buttons_layout.addWidget(mod_table, 1)
+        mod_filter_edit = qwidgets.QLineEdit()
+        mod_filter_edit.setPlaceholderText("Filter by name, author, origin or ID")
+        mod_filter_edit.setClearButtonEnabled(True)
         mod_buttons = qwidgets.QHBoxLayout()
         global statusbar
         statusbar = qwidgets.QStatusBar()
@@ -514,6 +854,22 @@ class D4mGUI:
         d4m_label.setContentsMargins(0, 0, 0, 0)
         log_msg(ver_str)
         window.setWindowTitle(ver_str)
+        if mod_manager.has_leftovers:
+            log_msg("Removing previously deleted mods in the background")
+            trash_signals = TrashSignals()
+            trash_signals.emptied.connect(
+                lambda freed: log_msg(f"Removed {freed / (1024 * 1024):.1f}Mb of previously deleted mods"))
+            mod_manager.trash.when_idle(trash_signals.emptied.emit)
+        mod_catalog = None
+        if d4m_config["catalog_search"]:
+            try:
+                mod_catalog = d4m.catalog.ModCatalog()
+                catalog_signals = LogSignals()
+                catalog_signals.message.connect(log_msg)
+                d4m.catalog.sync_in_background(mod_catalog, d4m_config["catalog_sync_hours"] * 60 * 60,
+                                               log=catalog_signals.message.emit)
+            except RuntimeError as e:
+                log_msg(f"Searching online, the mod catalog is unavailable: {e}")
 
         # Priority buttons
         # Signals are all connected later, so they can access the autoupdate func
@@ -563,8 +919,16 @@ class D4mGUI:
         action_about = QAction("About d4m", window)
         action_about.triggered.connect(lambda *_: show_about(main_window))
 
+        action_statistics = QAction("Statistics...", window)
+        action_statistics.triggered.connect(lambda *_: show_statistics(main_window))
+
+        action_profiling = QAction("Stop Profiling" if session_profiler.running else "Start Profiling", window)
+        action_profiling.triggered.connect(lambda *_: on_toggle_profiling(action_profiling))
+
         help_menu.addAction(action_github)
         help_menu.addAction(action_bug_report)
+        help_menu.addAction(action_statistics)
+        help_menu.addAction(action_profiling)
         help_menu.addAction(action_about)
 
         ### Propagate top row
@@ -586,11 +950,119 @@ class D4mGUI:
         top_row.addWidget(open_diva_folder)
         top_row.addWidget(mod_count_label)
 
-        image_thumbnail_cache = {}
+        thumbnail_cache = ThumbnailCache()
+        thumbnail_pool = PySide6.QtCore.QThreadPool()
+        thumbnail_pool.setMaxThreadCount(2)
+        thumbnail_signals = ThumbnailDecodeSignals()
+        thumbnails_pending = set()  # keys of thumbnails being decoded
+        mod_rows = {}  # mod path -> row in mod_table
+        row_mods = []  # row in mod_table -> mod, rows follow priority unless a sort is active
+        row_positions = []  # row in mod_table -> position of its mod in mod_index
+        hidden_rows = set()
+        # sort_column is None when the table follows priority order
+        table_view = {"index": ModIndex([]), "sort_column": None, "descending": False}
+        update_results = {}  # mod path -> error of its update check, empty if it succeeded
 
         ### Propagate mod list
         mod_table.setColumnCount(7)  # thumbnail, image, name, creator, version, id, size
 
+        def thumbnail_key(mod):
+            path = mod.get_thumbnail_path()
+            try:
+                return (path, os.path.getmtime(path)) if path else None
+            except OSError:
+                return None
+
+        def thumbnail_item(mod) -> qwidgets.QTableWidgetItem:
+            """Item for the thumbnail column. Thumbnails not decoded yet are filled in by load_visible_thumbnails."""
+            key = thumbnail_key(mod)
+            if key is None:
+                return qwidgets.QTableWidgetItem("No Preview")
+            mod_image = qwidgets.QTableWidgetItem("")
+            image = thumbnail_cache.get(key)
+            if image is not None:
+                mod_image.setData(PySide6.QtCore.Qt.DecorationRole, image)
+            return mod_image
+
+        def load_visible_thumbnails():
+            """Decode the thumbnails of the rows on screen and a few around them, in the background."""
+            row_count = min(mod_table.rowCount(), len(row_mods))
+            if row_count == 0:
+                return
+            first = mod_table.rowAt(0)
+            last = mod_table.rowAt(mod_table.viewport().height() - 1)
+            first = 0 if first < 0 else first
+            last = row_count - 1 if last < 0 else last
+            for row in range(max(0, first - THUMBNAIL_PREFETCH_ROWS), min(row_count, last + 1 + THUMBNAIL_PREFETCH_ROWS)):
+                if mod_table.isRowHidden(row):
+                    continue
+                key = thumbnail_key(row_mods[row])
+                if key is None or key in thumbnails_pending:
+                    continue
+                hit = thumbnail_cache.get(key) is not None
+                d4m.metrics.cache_lookup("gui.image_thumbnail_cache", hit)
+                if not hit:
+                    thumbnails_pending.add(key)
+                    thumbnail_pool.start(ThumbnailDecodeJob(key, thumbnail_signals))
+
+        def on_thumbnail_decoded(key, image):
+            thumbnails_pending.discard(key)
+            thumbnail_cache.put(key, image)
+            row = mod_rows.get(os.path.dirname(key[0]))
+            if row is not None and row < len(row_mods) and thumbnail_key(row_mods[row]) == key:
+                item = mod_table.item(row, 0)
+                if item is not None:
+                    item.setData(PySide6.QtCore.Qt.DecorationRole, image)
+
+        thumbnail_signals.decoded.connect(on_thumbnail_decoded)
+        # scrolling and resizing can both bring rows into view, coalesce them into one pass per event loop turn
+        visible_thumbnails_timer = PySide6.QtCore.QTimer()
+        visible_thumbnails_timer.setSingleShot(True)
+        visible_thumbnails_timer.setInterval(0)
+        visible_thumbnails_timer.timeout.connect(load_visible_thumbnails)
+        mod_table.verticalScrollBar().valueChanged.connect(lambda *_: visible_thumbnails_timer.start())
+        mod_table.verticalScrollBar().rangeChanged.connect(lambda *_: visible_thumbnails_timer.start())
+
+        def version_item(mod, update_check: bool) -> qwidgets.QTableWidgetItem:
+            if mod.is_simple():
+                mod_version = qwidgets.QTableWidgetItem(str(mod.version) + "*")
+                if mod.can_attempt_dmm_migration():
+                    mod_version.setToolTip("This mod may be able to be migrated from DivaModManager.")
+                    mod_version.setBackground(QColor.fromRgb(0, 255, 255))
+                else:
+                    mod_version.setToolTip(
+                        "This mod is missing metadata information and the latest version cannot be determined.")
+                return mod_version
+            mod_version = qwidgets.QTableWidgetItem(str(mod.version))
+            try:
+                if update_results.get(mod.path):
+                    raise RuntimeError(update_results[mod.path])
+                # mods whose status already arrived are shown even while the rest are still being checked
+                if (update_check or mod.path in update_results) and mod.is_out_of_date():
+                    mod_version.setBackground(QColor.fromRgb(255, 255, 0))
+                    mod_version.setToolTip("A new version is available.")
+            except RuntimeError as e:
+                mod_version.setBackground(QColor.fromRgb(255, 0, 0))
+                mod_version.setToolTip(f"An error occurred while checking for updates:\n{e}")
+            return mod_version
+
+        def row_of(mod):
+            row = mod_rows.get(mod.path)
+            if row is None or row >= len(row_mods) or row_mods[row].path != mod.path:
+                return None
+            return row
+
+        def on_mod_checked(mod, error: str):
+            update_results[mod.path] = error
+            table_view["index"].invalidate("out_of_date")
+            if (row := row_of(mod)) is not None:
+                mod_table.setItem(row, 4, version_item(row_mods[row], update_check=False))
+
+        def on_thumbnail_ready(mod):
+            if (row := row_of(mod)) is not None:
+                mod_table.setItem(row, 0, thumbnail_item(row_mods[row]))
+                visible_thumbnails_timer.start()
+
         def populate_modlist(update_check=True):
             mod_table.clear()
             mod_table.setSelectionBehavior(qwidgets.QAbstractItemView.SelectionBehavior.SelectRows)
@@ -606,43 +1078,26 @@ class D4mGUI:
             mod_table.horizontalHeader().setStretchLastSection(True)
             mod_table.verticalHeader().setSectionResizeMode(qwidgets.QHeaderView.ResizeMode.Fixed)
             mod_table.setRowCount(len(mod_manager.mods))
-            for (index, mod) in enumerate(mod_manager.mods):
-                mod_image = qwidgets.QTableWidgetItem("No Preview")
-                if mod.has_thumbnail():
-                    if not mod.is_simple() and mod.id in image_thumbnail_cache:
-                        image = image_thumbnail_cache[mod.id]
-                    else:
-                        base = QImage()
-                        base.load(mod.get_thumbnail_path())
-                        image = base.scaled(128, 128, aspectMode=PySide6.QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-                        if not mod.is_simple():
-                            image_thumbnail_cache[mod.id] = image
-                    mod_image.setData(PySide6.QtCore.Qt.DecorationRole, image)
-                    mod_image.setText("")
+            mod_index = ModIndex(mod_manager.mods)
+            table_view["index"] = mod_index
+            if table_view["sort_column"] is None:
+                row_positions[:] = range(len(mod_index))
+            else:
+                row_positions[:] = mod_index.order(SORT_COLUMNS[table_view["sort_column"]], table_view["descending"])
+            row_mods[:] = [mod_index.mods[position] for position in row_positions]
+            mod_rows.clear()
+            hidden_rows.clear()
+            for (index, mod) in enumerate(row_mods):
+                mod_rows[mod.path] = index
+                mod_image = thumbnail_item(mod)
                 mod_name = qwidgets.QTableWidgetItem(mod.name)
                 mod_name.setToolTip(mod.name)
                 mod_enabled = qwidgets.QTableWidgetItem("Enabled" if mod.enabled else "Disabled")
                 mod_author = qwidgets.QTableWidgetItem(mod.author)
                 mod_author.setToolTip(mod.author)
                 mod_size = qwidgets.QTableWidgetItem(f"{mod.size_bytes / (1024 * 1024):.1f}Mb")
-                if mod.is_simple():
-                    mod_version = qwidgets.QTableWidgetItem(str(mod.version) + "*")
-                    if mod.can_attempt_dmm_migration():
-                        mod_version.setToolTip("This mod may be able to be migrated from DivaModManager.")
-                        mod_version.setBackground(QColor.fromRgb(0, 255, 255))
-                    else:
-                        mod_version.setToolTip(
-                            "This mod is missing metadata information and the latest version cannot be determined.")
-                else:
-                    mod_version = qwidgets.QTableWidgetItem(str(mod.version))
-                    try:
-                        if update_check and mod.is_out_of_date():
-                            mod_version.setBackground(QColor.fromRgb(255, 255, 0))
-                            mod_version.setToolTip("A new version is available.")
-                    except RuntimeError as e:
-                        mod_version.setBackground(QColor.fromRgb(255, 0, 0))
-                        mod_version.setToolTip(f"An error occurred while checking for updates:\n{e}")
-
+                mod_version = version_item(mod, update_check)
+                if not mod.is_simple():
                     mod_id = qwidgets.QTableWidgetItem(str(mod.id))
 
                     fav = favicon_qimage(mod.origin)  # apply favicon if available
@@ -656,15 +1111,54 @@ class D4mGUI:
                 mod_table.setItem(index, 3, mod_author)
                 mod_table.setItem(index, 4, mod_version)
                 mod_table.setItem(index, 6, mod_size)
-                enabled_mod_count = sum(1 for m in mod_manager.mods if m.enabled)
-                mod_count_label.setText(f"{len(mod_manager.mods)} mod(s) / {enabled_mod_count} enabled")
+            apply_mod_filter()
+
+        def apply_mod_filter():
+            """Hide the rows not matching the filter box. Only rows whose visibility changes are touched."""
+            matches = table_view["index"].search(mod_filter_edit.text())
+            for row, position in enumerate(row_positions):
+                hide = position not in matches
+                if hide != (row in hidden_rows):
+                    mod_table.setRowHidden(row, hide)
+                    if hide:
+                        hidden_rows.add(row)
+                    else:
+                        hidden_rows.discard(row)
+            enabled_mod_count = sum(1 for m in mod_manager.mods if m.enabled)
+            mod_count_text = f"{len(mod_manager.mods)} mod(s) / {enabled_mod_count} enabled"
+            if hidden_rows:
+                mod_count_text = f"{len(row_positions) - len(hidden_rows)} shown / " + mod_count_text
+            mod_count_label.setText(mod_count_text)
+            visible_thumbnails_timer.start()
+
+        def on_sort_column_clicked(column: int):
+            if column not in SORT_COLUMNS:
+                table_view["sort_column"] = None
+            elif table_view["sort_column"] == column:
+                table_view["descending"] = not table_view["descending"]
+            else:
+                table_view["sort_column"] = column
+                table_view["descending"] = False
+            header = mod_table.horizontalHeader()
+            if table_view["sort_column"] is None:
+                header.setSortIndicatorShown(False)
+            else:
+                header.setSortIndicatorShown(True)
+                header.setSortIndicator(table_view["sort_column"], PySide6.QtCore.Qt.DescendingOrder
+                                        if table_view["descending"] else PySide6.QtCore.Qt.AscendingOrder)
+            populate_modlist(update_check=buw.updates_ready)
+            mod_contexts_available()
+
+        mod_table.horizontalHeader().setSectionsClickable(True)
+        mod_table.horizontalHeader().sectionClicked.connect(on_sort_column_clicked)
+        mod_filter_edit.textChanged.connect(lambda *_: apply_mod_filter())
 
         populate_modlist(update_check=False)
 
         def autoupdate(func, *args):
             """Selected mods will automatically be passed in as first argument."""
             selected_rows = set(map(lambda x: x.row(), mod_table.selectedIndexes()))
-            selected_mods = list(map(lambda i: mod_manager.mods[i], selected_rows))
+            selected_mods = list(map(lambda i: row_mods[i], selected_rows))
             r = func(selected_mods, *args)
             populate_modlist(update_check=buw.updates_ready)
             if r is not None:
@@ -679,7 +1173,7 @@ class D4mGUI:
 
         action_migrate_dmm = QAction("Migrate from DivaModManager...", window)
         action_migrate_dmm.triggered.connect(
-            lambda *_: on_migrate_clicked(mod_manager, populate_modlist(update_check=buw.updates_ready))
+            lambda *_: on_migrate_clicked(mod_manager, lambda: populate_modlist(update_check=buw.updates_ready))
         )
 
         # connect mod context buttons (needs access to autoupdate)
@@ -698,7 +1192,8 @@ class D4mGUI:
 
         ### Propagate action buttons
         install_mod_button = qwidgets.QPushButton("Install Mods...")
-        install_mod_button.clicked.connect(lambda *_: autoupdate(on_install_mod, mod_manager, populate_modlist))
+        install_mod_button.clicked.connect(
+            lambda *_: autoupdate(on_install_mod, mod_manager, populate_modlist, mod_catalog))
 
         toggle_mod_button = qwidgets.QPushButton("Toggle Selected")
         toggle_mod_button.clicked.connect(lambda *_: autoupdate(on_toggle_mod, mod_manager))
@@ -707,17 +1202,25 @@ class D4mGUI:
         update_mod_button.clicked.connect(lambda *_: autoupdate(on_update_mod, mod_manager))
         update_mod_button.setEnabled(False)
 
+        rollback_mod_button = qwidgets.QPushButton("Roll Back Selected")
+        rollback_mod_button.clicked.connect(lambda *_: autoupdate(on_rollback_mod, mod_manager))
+        rollback_mod_button.setToolTip("Restore the version replaced by the last update")
+
         delete_mod_button = qwidgets.QPushButton("Delete Selected")
         delete_mod_button.clicked.connect(lambda *_: autoupdate(on_delete_mod, mod_manager))
 
         def mod_contexts_available():
             context_enabled = len(set(map(lambda x: x.row(), mod_table.selectedIndexes()))) == 1
             edit_mod_config_button.setEnabled(context_enabled)
-            priority_increase_button.setEnabled(context_enabled)
-            priority_decrease_button.setEnabled(context_enabled)
+            # priority follows the order of the rows, which a sort replaces. Neighbours in a filtered list are
+            # not neighbours in priority either, the mod would be swapped with a hidden one.
+            priority_movable = context_enabled and table_view["sort_column"] is None and not mod_filter_edit.text()
+            priority_increase_button.setEnabled(priority_movable)
+            priority_decrease_button.setEnabled(priority_movable)
             open_mod_folder_button.setEnabled(context_enabled)
 
         mod_table.itemSelectionChanged.connect(mod_contexts_available)
+        mod_filter_edit.textChanged.connect(lambda *_: mod_contexts_available())
 
         refresh_mod_button = qwidgets.QPushButton("Refresh")
         refresh_mod_button.clicked.connect(lambda *_: autoupdate(on_refresh_click, mod_manager))
@@ -725,11 +1228,18 @@ class D4mGUI:
         mod_buttons.addWidget(install_mod_button)
         mod_buttons.addWidget(toggle_mod_button)
         mod_buttons.addWidget(update_mod_button)
+        mod_buttons.addWidget(rollback_mod_button)
         mod_buttons.addWidget(delete_mod_button)
         mod_buttons.addWidget(refresh_mod_button)
 
-        buw = BackgroundUpdateWorker(mod_manager, populate_modlist,
-                                     on_complete=lambda *_: update_mod_button.setEnabled(True))
+        def on_update_check_finished(error: str):
+            log_msg(f"Update check failed: {error}" if error else "Update check complete.")
+            update_mod_button.setEnabled(True)
+
+        buw = BackgroundUpdateWorker(mod_manager)
+        buw.signals.mod_checked.connect(on_mod_checked)
+        buw.signals.thumbnail_ready.connect(on_thumbnail_ready)
+        buw.signals.finished.connect(on_update_check_finished)
         threadpool.start(buw)
 
         # # Populate main GUI
@@ -738,6 +1248,7 @@ class D4mGUI:
         main_window.setStatusBar(statusbar)
 
         main_widget.addLayout(top_row)
+        main_widget.addWidget(mod_filter_edit)
         main_widget.addLayout(mod_table_and_buttons_layout)
         main_widget.addLayout(mod_buttons)
 
@@ -747,6 +1258,8 @@ class D4mGUI:
 
 
 def main():
+    if profiling_requested():
+        start_session_profile()
     app = qwidgets.QApplication([])
 
     try:  # libarchive check
@@ -811,7 +1324,15 @@ def main():
             content = f"Cannot fetch latest DivaModLoader version: {format_exc()}"
             show_d4m_infobox(content, level="warn")
 
-    mod_manager = ModManager(megamix_path, mods_path=dml_mods_dir)
+    mod_manager = ModManager(megamix_path, mods_path=dml_mods_dir,
+                             generations_kept=d4m_config["update_generations_kept"])
+
+    if d4m_config["hedge_metadata_after_ms"] > 0:
+        d4m.net.METADATA_HEDGE_AFTER = d4m_config["hedge_metadata_after_ms"] / 1000
+
+    if d4m_config["prefetch_updates"]:
+        mod_manager.enable_prefetch(bandwidth_limit=d4m_config["prefetch_bandwidth_limit_kb"] * 1024,
+                                    quota_bytes=d4m_config["prefetch_quota_mb"] * 1024 * 1024)
 
     D4mGUI(app, mod_manager, dml_version, d4m_config)
 
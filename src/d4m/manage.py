@@ -1,11 +1,20 @@
+import contextlib
 import functools
+from concurrent.futures import ThreadPoolExecutor, wait
 from io import BytesIO
+import json
 import os
+import threading
+import time
 
-import requests
+import d4m.metrics as metrics
+import d4m.net as net
 import packaging.version
 from d4m.divamod import DivaMod, DivaSimpleMod, UnmanageableModError, diva_mod_create
+from d4m.prefetch import UpdatePrefetcher
+from d4m.tracing import span, traced
 import d4m.api as api
+import d4m.common
 import tempfile
 import shutil
 import libarchive.public
@@ -13,17 +22,58 @@ import toml
 
 from traceback import print_exc
 
+D4M_FOLDER_PREFIX = ".d4m-"  # folders in the mods folder used internally by d4m, never loaded as mods
+STAGING_PREFIX = D4M_FOLDER_PREFIX + "staging-"
+GENERATIONS_FOLDER = D4M_FOLDER_PREFIX + "generations"  # previous versions of updated mods, in <mod folder>/<time>
+TRASH_FOLDER = D4M_FOLDER_PREFIX + "trash"
+PREFETCH_FOLDER = D4M_FOLDER_PREFIX + "prefetch"
+UPDATE_STATE_FILE = D4M_FOLDER_PREFIX + "updates.json"  # per origin: when it was checked, and the metadata it sent
+FULL_UPDATE_CHECK_INTERVAL = 7 * 24 * 60 * 60  # incremental update checks still check every mod this often
+CHANGE_FEED_OVERLAP = 60 * 60  # change feeds are read from a bit before the last check, in case of clock skew
+UPDATE_CHECK_DEADLINE = 60  # seconds an update check waits for an origin before reporting it as failed
+
+
+class UpdateCheckError(RuntimeError):
+    """Some origins could not be checked for updates, errors maps each of them to its exception."""
+
+    def __init__(self, errors: dict):
+        super().__init__("; ".join(f"{origin}: {e}" for origin, e in errors.items()))
+        self.errors = errors
+
 
 class ModManager:
-    def __init__(self, base_path, mods_path=None):
+    """Installed mods of a Project Diva install.
+
+    `mods` is an immutable snapshot (a tuple, in priority order) that is replaced as a whole by
+    every change, so it can be iterated from any thread while other threads install, delete or
+    reorder mods. Changes to the mod list are serialized by a lock.
+    """
+
+    def __init__(self, base_path, mods_path=None, generations_kept=1):
         self.base_path = base_path
         self.mods_path = mods_path
+        self.generations_kept = generations_kept
         with open(os.path.join(self.base_path, "config.toml"), "r") as conf_fd:
             data = toml.load(conf_fd)
             self.enabled = data["enabled"]
             if not mods_path:
-                mods_path = data.get("mods", "mods")
-        self.mods = self.load_mods(mods_path)
+                self.mods_path = os.path.join(self.base_path, data.get("mods", "mods"))
+        self._lock = threading.RLock()  # held while changing mods, its indexes or the priority list
+        self.mods = tuple(self.load_mods(self.mods_path))
+        self._rebuild_index()
+        self.trash = TrashReclaimer(os.path.join(self.mods_path, TRASH_FOLDER))
+        self.prefetcher = None
+        self._recover_leftovers()
+
+    def enable_prefetch(self, bandwidth_limit: int = 0, quota_bytes: int = 0):
+        """Download the archives of out of date mods in the background after checking for updates.
+
+        Params:
+            bandwidth_limit - maximum download rate in bytes/s, 0 for no limit
+            quota_bytes - maximum size of the prefetched archives, 0 for no limit
+        """
+        self.prefetcher = UpdatePrefetcher(os.path.join(self.mods_path, PREFETCH_FOLDER),
+                                           bandwidth_limit=bandwidth_limit, quota_bytes=quota_bytes)
 
     def disable_dml(self):
         with open(os.path.join(self.base_path, "config.toml"), "r") as conf_fd:
@@ -47,142 +97,715 @@ class ModManager:
     def disable(self, mod: DivaMod):
         mod.disable()
 
+    @traced("ModManager.update")
     def update(self, mod: DivaMod, fetch_thumbnail=False):
+        """Update a mod in place.
+
+        The new version is downloaded and extracted into a staging folder while the installed
+        version stays untouched, then the two are swapped. The replaced version is kept as a
+        hidden generation (see `rollback`).
+        """
+        if not mod.is_simple():
+            data = api.fetch_mod_data(mod.id, mod.category, origin=mod.origin)
+            archive = self.prefetcher.take(mod.origin, mod.id, data["hash"]) if self.prefetcher else None
+            if archive is None:
+                archive = api.download_mod(data["download"])
+            mod_root, required_bytes = inspect_archive(archive)
+            ensure_free_space(self.mods_path, required_bytes)
+            with self._staging_dir() as staging_dir:
+                staged = os.path.join(staging_dir, "mod")
+                extract_archive(archive, staged, mod_root=mod_root)
+                write_modinfo(staged, mod.id, data["hash"], mod.origin, mod.category)
+                self._swap_in(staged, mod.path)
+            new_mod = self._replace_mod(mod, diva_mod_create(mod.path))
+            self._prune_generations(new_mod)
+
+            if fetch_thumbnail:
+                self.fetch_thumbnail(new_mod)
+
+    def _generations_dir(self, mod_folder: str) -> str:
+        # outside the top level of the mods folder, so DivaModLoader never loads previous versions
+        return os.path.join(self.mods_path, GENERATIONS_FOLDER, os.path.basename(mod_folder))
+
+    def generations(self, mod: DivaSimpleMod) -> "list[str]":
+        """Return the paths of the previous versions kept for a mod, newest first."""
+        generations_dir = self._generations_dir(mod.path)
+        try:
+            timestamps = [int(folder) for folder in os.listdir(generations_dir) if folder.isdigit()]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(generations_dir, str(timestamp)) for timestamp in sorted(timestamps, reverse=True)]
+
+    def can_rollback(self, mod: DivaSimpleMod) -> bool:
+        return len(self.generations(mod)) > 0
+
+    def rollback(self, mod: DivaSimpleMod) -> DivaSimpleMod:
+        """Swap a mod with the version it most recently replaced. Rolling back twice restores the update.
+
+        Returns: the restored mod.
+        """
+        generations = self.generations(mod)
+        if not generations:
+            raise RuntimeError(f"no previous version of {mod.name} is available")
+        self._swap_in(generations[0], mod.path)
+        return self._replace_mod(mod, diva_mod_create(mod.path))
+
+    def _swap_in(self, new_folder: str, mod_folder: str):
+        """Move new_folder to mod_folder, keeping the folder it replaces as the newest generation."""
+        generations_dir = self._generations_dir(mod_folder)
+        os.makedirs(generations_dir, exist_ok=True)
+        generation = os.path.join(generations_dir, str(time.time_ns()))
+        os.rename(mod_folder, generation)
+        try:
+            os.rename(new_folder, mod_folder)
+        except OSError:
+            os.rename(generation, mod_folder)
+            raise
+
+    def _prune_generations(self, mod: DivaSimpleMod, keep: int = None):
+        """Trash the previous versions of a mod beyond the keep (generations_kept by default) newest."""
+        keep = self.generations_kept if keep is None else keep
+        for generation in self.generations(mod)[max(keep, 0):]:
+            self.trash.discard(generation)
+        try:
+            os.rmdir(self._generations_dir(mod.path))
+        except OSError:  # missing, or still has generations
+            pass
+
+    def _replace_mod(self, old: DivaSimpleMod, new: DivaSimpleMod) -> DivaSimpleMod:
+        """Replace old with new in the mod list, keeping its priority."""
+        with self._lock:
+            mods = list(self.mods)
+            try:
+                mods[mods.index(old)] = new
+                self._unindex(old)
+            except ValueError:
+                mods.append(new)
+            self._index(new)
+            self.mods = tuple(mods)
+        return new
+
+    def _add_mod(self, mod: DivaSimpleMod) -> DivaSimpleMod:
+        with self._lock:
+            self.mods = self.mods + (mod,)
+            self._index(mod)
+        return mod
+
+    def shift_priority(self, mod: DivaSimpleMod, shift: int):
+        """Swap a mod with the mod shift places away from it in priority order, and save the priority.
+
+        Returns: the new position of the mod, or None if it would be moved out of bounds.
+        """
+        with self._lock:
+            mods = list(self.mods)
+            position = mods.index(mod)
+            if not 0 <= position + shift < len(mods):
+                return None
+            mods[position], mods[position + shift] = mods[position + shift], mods[position]
+            self.mods = tuple(mods)
+            self.save_priority()
+            return position + shift
+
+    def _rebuild_index(self):
+        installed = {}  # (origin, str(id)) -> installed mods with that id
+        folders = {}  # folder name -> mod
+        for mod in self.mods:
+            folders[os.path.basename(mod.path)] = mod
+            if not mod.is_simple():
+                installed.setdefault((mod.origin, str(mod.id)), []).append(mod)
+        self._installed = installed
+        self._folders = folders
+
+    def _index(self, mod: DivaSimpleMod):
+        # the index lists are replaced rather than changed, readers don't take the lock
+        self._folders[os.path.basename(mod.path)] = mod
         if not mod.is_simple():
-            self.delete_mod(mod)
-            self.install_mod(mod.id, mod.category, fetch_thumbnail=fetch_thumbnail, origin=mod.origin)
+            key = (mod.origin, str(mod.id))
+            self._installed[key] = self._installed.get(key, []) + [mod]
+
+    def _unindex(self, mod: DivaSimpleMod):
+        if self._folders.get(os.path.basename(mod.path)) is mod:
+            del self._folders[os.path.basename(mod.path)]
+        if not mod.is_simple():
+            key = (mod.origin, str(mod.id))
+            remaining = [m for m in self._installed.get(key, []) if m is not mod]
+            if remaining:
+                self._installed[key] = remaining
+            else:
+                self._installed.pop(key, None)
 
     def is_enabled(self, mod: DivaMod):
         return mod.enabled
 
     def delete_mod(self, mod: DivaMod):
-        shutil.rmtree(mod.path)
-        self.mods.remove(mod)
+        """Remove a mod and its previous versions. The folders are moved to the trash and removed in the background."""
+        self.trash.discard(mod.path)  # may fall back to deleting the folder right away, not worth holding the lock
+        self._prune_generations(mod, keep=0)
+        with self._lock:
+            self.mods = tuple(m for m in self.mods if m is not mod)
+            self._unindex(mod)
+
+    def _recover_leftovers(self):
+        """Clean up after a previous session that exited before finishing its work.
+
+        Staging folders of interrupted installs are trashed, and anything still in the
+        trash is removed in the background. Sizing the leftovers is left to the reclaimer thread,
+        see TrashReclaimer.when_idle.
+        """
+        for folder in os.listdir(self.mods_path):
+            if folder.startswith(STAGING_PREFIX):
+                self.trash.discard(os.path.join(self.mods_path, folder))
+        self.has_leftovers = self.trash.has_pending()
+        if self.has_leftovers:
+            self.trash.wake()
+
+    @traced("ModManager.fetch_thumbnail")
+    def fetch_thumbnail(self, mod: DivaMod, force=False) -> bool:
+        """Download the thumbnail of a mod, unless it already has one.
 
-    def fetch_thumbnail(self, mod: DivaMod, force=False):
+        Returns: whether a thumbnail was written.
+        """
         if force or not mod.has_thumbnail():
             data = api.fetch_mod_data(mod.id, mod.category, origin=mod.origin)
             img_url = data["image"]
-            resp = requests.get(img_url)
+            resp = net.get(img_url)
             if resp.status_code == 200:
                 with open(os.path.join(mod.path, "preview.png"), "wb") as preview_fd:
                     preview_fd.write(resp.content)
+                return True
+        return False
 
+    @traced("ModManager.install_from_archive")
     def install_from_archive(self, archive_path: str):
         with open(archive_path, "rb") as arch_fd:
-            with tempfile.TemporaryDirectory(suffix="d4m") as tempdir:
-                extract_archive(arch_fd.read(), tempdir)
-                extracted = os.listdir(tempdir)
-                if "config.toml" in extracted:
-                    mod_folder = os.path.basename(archive_path)
-                    shutil.move(tempdir, os.path.join(self.mods_path, mod_folder))
-                elif len(extracted) == 1:
-                    mod_folder = os.path.join(self.mods_path, extracted[0])
-                    shutil.move(os.path.join(tempdir, extracted[0]), mod_folder)
-                else:
-                    raise RuntimeError("failed to install mod from archive: archive format unusable")
-                new_mod = diva_mod_create(mod_folder)
-                self.mods.append(new_mod)
+            archive = arch_fd.read()
+        mod_folder = self._extract_mod(archive, os.path.basename(archive_path))
+        self._add_mod(diva_mod_create(mod_folder))
 
+    @traced("ModManager.install_mod")
     def install_mod(self, mod_id: int, category: str, fetch_thumbnail=False,
-                    origin="gamebanana"):  # mod_id and hash are used for modinfo.toml
+                    origin="gamebanana", download_progress=None, extract_progress=None,
+                    cancelled: threading.Event = None):  # mod_id and hash are used for modinfo.toml
+        """Download and install a mod.
+
+        Params:
+            download_progress - called with (bytes received, total bytes) while downloading
+            extract_progress - called with (entries extracted, bytes extracted, total bytes) while extracting
+            cancelled - if given, the install stops with api.OperationCancelled once this event is set,
+                        as long as the mod has not been moved into the mods folder yet
+        """
         data = api.fetch_mod_data(mod_id, category, origin=origin)
-        with tempfile.TemporaryDirectory(suffix="-d4m") as tempdir:
-            api.download_and_extract_mod(data["download"], tempdir)
-            extracted = os.listdir(tempdir)
-            if "config.toml" in extracted:
-                mod_folder_name = os.path.join(self.mods_path,
-                                               str(mod_id))  # TODO: move it to a folder using the mod's name
-                shutil.move(tempdir, mod_folder_name)
-            elif len(extracted) == 1:
-                mod_folder_name = os.path.join(self.mods_path, extracted[0])
-                shutil.move(os.path.join(tempdir, extracted[0]), mod_folder_name)
-            else:
-                raise RuntimeError("Failed to install mod: archive directory unusable")
-            with open(os.path.join(mod_folder_name, "modinfo.toml"), "w") as modinfo_fd:
-                data = {
-                    "id": mod_id,
-                    "hash": data["hash"],
-                    "origin": origin,
-                    "category": category
-                }
-                toml.dump(data, modinfo_fd)
-            new_mod = diva_mod_create(mod_folder_name)
-
-            self.mods.append(new_mod)
-
-            # download mod thumbnail
-            if fetch_thumbnail:
-                self.fetch_thumbnail(new_mod)
+        archive = api.download_mod(data["download"], progress=download_progress, cancelled=cancelled)
+        # TODO: move it to a folder using the mod's name
+        mod_folder_name = self._extract_mod(archive, str(mod_id), progress=extract_progress, cancelled=cancelled)
+        write_modinfo(mod_folder_name, mod_id, data["hash"], origin, category)
+        new_mod = self._add_mod(diva_mod_create(mod_folder_name))
+
+        # download mod thumbnail
+        if fetch_thumbnail:
+            self.fetch_thumbnail(new_mod)
+
+    def _extract_mod(self, archive: bytes, fallback_name: str, progress=None,
+                     cancelled: threading.Event = None) -> str:
+        """Extract the mod contained in an archive into the mods folder.
+
+        The archive is inspected before anything is written, so unusable layouts and
+        a lack of disk space are reported without extracting the archive.
+
+        Params:
+            archive - raw bytes of the archive
+            fallback_name - folder name to use when config.toml is at the top level of the archive
+            progress - called with (entries extracted, bytes extracted, total bytes)
+            cancelled - if given, extraction stops with api.OperationCancelled once this event is set
 
-    def check_for_updates(self, get_thumbnails=False):
-        for origin in api.SUPPORTED_APIS.keys():
+        Returns: the path of the newly extracted mod folder.
+        """
+        mod_root, required_bytes = inspect_archive(archive)
+        ensure_free_space(self.mods_path, required_bytes)
+        mod_folder = os.path.join(self.mods_path, os.path.basename(mod_root) if mod_root else fallback_name)
+        entry_progress = None
+        if progress:
+            entry_progress = lambda entries, extracted_bytes: progress(entries, extracted_bytes, required_bytes)
+        with self._staging_dir() as staging_dir:
+            staged = os.path.join(staging_dir, "mod")
+            extract_archive(archive, staged, mod_root=mod_root, progress=entry_progress, cancelled=cancelled)
+            if os.path.exists(mod_folder):
+                raise RuntimeError(f"failed to install mod: {mod_folder} already exists")
+            os.rename(staged, mod_folder)
+        return mod_folder
+
+    def _staging_dir(self) -> tempfile.TemporaryDirectory:
+        """Create a temporary directory inside the mods folder.
+
+        Staging on the same filesystem as the mods folder means a staged mod can be
+        moved into place with a single rename instead of copying every file.
+        """
+        return tempfile.TemporaryDirectory(prefix=STAGING_PREFIX, dir=self.mods_path)
+
+    @traced("ModManager.check_for_updates")
+    def check_for_updates(self, get_thumbnails=False, on_result=None, on_thumbnail=None, full=None,
+                          timeout=UPDATE_CHECK_DEADLINE):
+        """Fetch the latest data of every mod, with one bulk request per origin.
+
+        Origins are checked concurrently, and results are reported as soon as they arrive. If an
+        origin fails or misses the deadline, the others are still checked and an UpdateCheckError
+        naming the failed origins is raised at the end.
+
+        Unless full is set, origins fully checked in the last FULL_UPDATE_CHECK_INTERVAL are checked
+        incrementally: only the mods listed by the origin's change feed since the last check are
+        fetched, the others reuse the metadata saved by the previous check.
+
+        Params:
+            get_thumbnails - also download the thumbnails of mods that have none
+            on_result - called with (mod, error) once the update status of a mod is known, error is None
+                        if the check succeeded. Called from worker threads.
+            on_thumbnail - called with each mod whose thumbnail was just downloaded
+            full - fetch the metadata of every mod, regardless of when the last full check was
+            timeout - seconds to wait for the origins, None to wait as long as they take. Thumbnails are
+                      downloaded after the deadline.
+        """
+        saved_state = self._load_update_state()
+        reported = set()  # origins whose result was passed to on_result, a late origin only gets its timeout
+        reported_lock = threading.Lock()
+        until = None if timeout is None else time.monotonic() + timeout
+
+        def report(origin, mods, error):
+            with reported_lock:
+                if origin in reported:
+                    return False
+                reported.add(origin)
+            if on_result:
+                for mod in mods:
+                    on_result(mod, error)
+            return True
+
+        def check_origin(origin):
             mods_from_origin = self.mods_from(origin)
-            api.multi_fetch_mod_data(set(map(lambda x: (x.id, x.category), mods_from_origin)), origin=origin)
+            begin = time.time()
+            try:
+                with net.deadline(until - time.monotonic()) if until is not None else contextlib.nullcontext():
+                    to_check, was_full = self._mods_to_check(origin, mods_from_origin, saved_state.get(origin), full,
+                                                             begin)
+                    api.multi_fetch_mod_data(set(map(lambda x: (x.id, x.category), to_check)), origin=origin)
+            except Exception as e:
+                report(origin, mods_from_origin, e)
+                raise
+            if not report(origin, mods_from_origin, None):
+                raise net.DeadlineExceeded(f"no answer within {timeout}s")
+            remote = {}
+            for mod in mods_from_origin:
+                data = api.fetch_mod_data(mod.id, mod.category, origin=origin)  # cached by now
+                if "error" not in data:
+                    remote[str(mod.id)] = data
+            state = {"checked": begin, "full": begin if was_full else saved_state[origin]["full"], "mods": remote}
+            return mods_from_origin, state
+
+        pool = ThreadPoolExecutor(max_workers=len(api.SUPPORTED_APIS))
+        futures = {origin: pool.submit(check_origin, origin) for origin in api.SUPPORTED_APIS.keys()}
+        wait(futures.values(), timeout=timeout)
+        pool.shutdown(wait=False)  # late origins are abandoned, their deadline stops them soon
+        errors = {}
+        checked = []
+        for origin, future in futures.items():
+            if not future.done():
+                error = net.DeadlineExceeded(f"no answer within {timeout}s")
+                if report(origin, self.mods_from(origin), error):
+                    errors[origin] = error
+                    continue
+                wait([future])  # answered just in time, only cached data is left to read
+            if future.exception() is not None:
+                errors[origin] = future.exception()
+            else:
+                checked.extend(future.result()[0])
+                saved_state[origin] = future.result()[1]
+        self._save_update_state(saved_state)
         if get_thumbnails:
-            for mod in self.mods:
-                if not mod.is_simple():
-                    try:
-                        self.fetch_thumbnail(mod)
-                    except Exception as e:
-                        print(f"failed to get thumbnail {e}")
+            for mod in checked:
+                try:
+                    if self.fetch_thumbnail(mod) and on_thumbnail:
+                        on_thumbnail(mod)
+                except Exception as e:
+                    print(f"failed to get thumbnail {e}")
+        if self.prefetcher:
+            self.prefetcher.start(self.out_of_date_mods())
+        if errors:
+            raise UpdateCheckError(errors)
+
+    def _mods_to_check(self, origin: str, mods: list, saved: dict, full, now: float) -> "tuple[list, bool]":
+        """Pick the mods of origin whose metadata has to be fetched.
+
+        Returns: the mods to fetch, and whether that is a full check.
+        """
+        if full or not saved or now - saved["full"] > FULL_UPDATE_CHECK_INTERVAL:
+            return mods, True
+        try:
+            changed = api.changed_mod_ids(saved["checked"] - CHANGE_FEED_OVERLAP, origin=origin)
+        except Exception:
+            print_exc()
+            changed = None
+        if changed is None:  # the changes could not be listed
+            return mods, True
+        to_check = []
+        for mod in mods:
+            data = saved["mods"].get(str(mod.id))
+            if data is None or str(mod.id) in changed:
+                to_check.append(mod)
+            else:
+                api.remember_mod_data(mod.id, data, origin=origin)
+        metrics.inc("manage.update_checks_skipped", len(mods) - len(to_check), label=origin)
+        return to_check, False
+
+    def _load_update_state(self) -> dict:
+        try:
+            with open(os.path.join(self.mods_path, UPDATE_STATE_FILE), "r", encoding="UTF-8") as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_update_state(self, state: dict):
+        path = os.path.join(self.mods_path, UPDATE_STATE_FILE)
+        with open(path + ".tmp", "w", encoding="UTF-8") as fd:
+            json.dump(state, fd)
+        os.replace(path + ".tmp", path)
+
+    def dmm_migration_candidates(self) -> "list[DivaSimpleMod]":
+        """Return the mods installed by DivaModManager, which migrate_from_dmm will attempt to migrate."""
+        return [m for m in self.mods if m.is_simple() and m.can_attempt_dmm_migration()]
+
+    @traced("ModManager.migrate_from_dmm")
+    def migrate_from_dmm(self, max_workers: int = 8, on_result=None) -> "tuple[list[DivaMod], list[DivaSimpleMod]]":
+        """Migrate every mod installed by DivaModManager that links to GameBanana.
+
+        The mod.json files are read in parallel, and all the ids found are checked with one bulk
+        request before the modinfo files are written. Migrated mods are replaced in the mod list.
+
+        Params:
+            on_result - called with (mod, whether it was migrated) for each candidate, once its outcome is known
+
+        Returns: the migrated mods, and the eligible mods that could not be migrated.
+        """
+        eligible = self.dmm_migration_candidates()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            found_ids = list(pool.map(lambda m: m.dmm_gamebanana_id(), eligible))
+        candidates = [(mod, mod_id) for mod, mod_id in zip(eligible, found_ids) if mod_id is not None]
+        failed = []
+
+        def fail(mod):
+            failed.append(mod)
+            if on_result:
+                on_result(mod, False)
+
+        for mod, mod_id in zip(eligible, found_ids):
+            if mod_id is None:
+                fail(mod)
+        valid_ids = set()
+        if candidates:
+            try:
+                # TODO: maybe don't assume mod here?
+                for data in api.multi_fetch_mod_data({(mod_id, "Mod") for _, mod_id in candidates}, origin="gamebanana"):
+                    if "error" not in data:
+                        valid_ids.add(str(data["id"]))
+            except RuntimeError:
+                print_exc()
+        migrated = []
+        for mod, mod_id in candidates:
+            if str(mod_id) not in valid_ids:
+                fail(mod)
+                continue
+            try:
+                write_modinfo(mod.path, mod_id, "no-hash", "gamebanana", "Mod")
+            except OSError:
+                print_exc()
+                fail(mod)
+                continue
+            migrated.append(self._replace_mod(mod, diva_mod_create(mod.path)))
+            if on_result:
+                on_result(migrated[-1], True)
+        return migrated, failed
+
+    def out_of_date_mods(self) -> "list[DivaMod]":
+        """Return the mods known to be out of date. Mods whose update check failed are left out."""
+        out_of_date = []
+        for mod in self.mods:
+            if mod.is_simple():
+                continue
+            try:
+                if mod.is_out_of_date():
+                    out_of_date.append(mod)
+            except RuntimeError:
+                pass
+        return out_of_date
 
     def mods_from(self, origin):
         """Return a list of mods from a specified origin."""
         return [m for m in self.mods if not m.is_simple() and m.origin == origin]
 
     def mod_is_installed(self, s_id, origin: str = "gamebanana") -> bool:
-        for mod in self.mods:
-            if not mod.is_simple() and mod.id == s_id and mod.origin == origin:
-                return True
-        return False
+        return (origin, str(s_id)) in self._installed
+
+    def installed_mod(self, s_id, origin: str = "gamebanana"):
+        """Return the installed mod with this id, or None if it is not installed."""
+        found = self._installed.get((origin, str(s_id)))
+        return found[0] if found else None
+
+    def mod_in_folder(self, folder: str):
+        """Return the mod installed in this folder of the mods folder, or None."""
+        return self._folders.get(folder)
+
+    def annotate_installed(self, results: "list[dict]") -> "list[dict]":
+        """Set the "installed" key of every search result (dicts with an id and an origin).
+
+        Returns: results, for convenience.
+        """
+        for result in results:
+            result["installed"] = (result["origin"], str(result["id"])) in self._installed
+        return results
 
     def reload(self):
-        self.mods = self.load_mods(self.mods_path)
+        with self._lock:
+            self.mods = tuple(self.load_mods(self.mods_path))
+            self._rebuild_index()
 
+    @traced("ModManager.load_mods")
     def load_mods(self, path: str) -> "list[DivaSimpleMod]":
         with open(os.path.join(self.base_path, "config.toml"), "r", encoding="utf-8") as fd:
             priority = toml.load(fd).get("priority", [])
         loaded = []
-        for mod_path in os.listdir(path):
-            full_mod_path = os.path.join(path, mod_path)
-            if os.path.isdir(full_mod_path):
-                try:
-                    loaded.append(diva_mod_create(full_mod_path))
-                except:
-                    print_exc()
+        with metrics.timed("manage.scan_mods"):
+            for mod_path in os.listdir(path):
+                full_mod_path = os.path.join(path, mod_path)
+                if os.path.isdir(full_mod_path) and not mod_path.startswith(D4M_FOLDER_PREFIX):
+                    try:
+                        loaded.append(diva_mod_create(full_mod_path))
+                    except:
+                        print_exc()
+        for mod in loaded:
+            if not mod.is_simple():  # lazy modinfo lookups are then batched with the rest of the library
+                api.mod_data_loader.hint(mod.id, mod.category, mod.origin)
         final = []
         ##now, order by priority
+        by_folder = {os.path.basename(mod.path): mod for mod in loaded}
         for l in priority:
-            for index, mod in enumerate(loaded):
-                if os.path.basename(mod.path) == l:
-                    final.append(loaded.pop(index))
-                    break
+            mod = by_folder.pop(l, None)
+            if mod is not None:
+                final.append(mod)
 
-        final.extend(loaded)  # append whatever is left as bottom priority
+        final.extend(mod for mod in loaded if os.path.basename(mod.path) in by_folder)  # whatever is left is bottom priority
         return final
 
+    @traced("ModManager.save_priority")
     def save_priority(self):
         dml_conf_path = os.path.join(self.base_path, "config.toml")
-        with open(dml_conf_path, "r", encoding="utf-8") as fd:
-            d = toml.load(fd)
-        d["priority"] = [os.path.basename(m.path) for m in self.mods]
-        with open(dml_conf_path, "w", encoding="utf-8") as fd:
-            toml.dump(d, fd)
+        with self._lock:
+            with open(dml_conf_path, "r", encoding="utf-8") as fd:
+                d = toml.load(fd)
+            d["priority"] = [os.path.basename(m.path) for m in self.mods]
+            with open(dml_conf_path, "w", encoding="utf-8") as fd:
+                toml.dump(d, fd)
+
+
+class TrashReclaimer:
+    """Removes folders on a background thread.
+
+    Folders are first renamed into the trash folder, which is constant time as long as the trash
+    is on the same filesystem. Anything left in the trash when d4m exits is removed the next time
+    the reclaimer is woken up.
+    """
+
+    def __init__(self, trash_path: str):
+        self.trash_path = trash_path
+        self._reclaimed_bytes = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._idle_callbacks = []
+
+    def discard(self, path: str):
+        """Move path into the trash and schedule its removal."""
+        os.makedirs(self.trash_path, exist_ok=True)
+        try:
+            os.rename(path, os.path.join(self.trash_path, f"{time.time_ns()}-{os.path.basename(path)}"))
+        except OSError:
+            shutil.rmtree(path)  # not renameable (e.g. open files on Windows), remove it right away
+            return
+        self.wake()
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        """Size of everything removed so far."""
+        with self._lock:
+            return self._reclaimed_bytes
 
+    def has_pending(self) -> bool:
+        """Return whether anything is waiting in the trash, without sizing it."""
+        try:
+            return len(os.listdir(self.trash_path)) > 0
+        except FileNotFoundError:
+            return False
 
-def extract_archive(archive: bytes, extract_to: str) -> None:
+    def when_idle(self, callback):
+        """Call callback with reclaimed_bytes once the trash is empty.
+
+        It is called right away from this thread if the reclaimer is not running, from the reclaimer
+        thread otherwise.
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._idle_callbacks.append(callback)
+                return
+            reclaimed = self._reclaimed_bytes
+        callback(reclaimed)
+
+    def wake(self):
+        with self._lock:
+            self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="d4m-trash-reclaimer", daemon=True)
+                self._thread.start()
+
+    def join(self, timeout=None):
+        """Wait for the trash to be emptied."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._wake.is_set():
+                    self._thread = None
+                    callbacks, self._idle_callbacks = self._idle_callbacks, []
+                    reclaimed = self._reclaimed_bytes
+                    break
+                self._wake.clear()
+            for entry in os.listdir(self.trash_path):
+                path = os.path.join(self.trash_path, entry)
+                size = folder_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+                with self._lock:
+                    self._reclaimed_bytes += size
+        for callback in callbacks:
+            callback(reclaimed)
+
+
+def folder_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename)) for dirpath, _, filenames in os.walk(path) for filename in
+        filenames)
+
+
+def write_modinfo(mod_folder: str, mod_id, mod_hash: str, origin: str, category: str):
+    """Write the modinfo.toml d4m uses to track where a mod came from."""
+    with open(os.path.join(mod_folder, "modinfo.toml"), "w") as modinfo_fd:
+        data = {
+            "id": mod_id,
+            "hash": mod_hash,
+            "origin": origin,
+            "category": category
+        }
+        toml.dump(data, modinfo_fd)
+
+
+def _entry_path(pathname: str) -> str:
+    """Normalize an archive entry path to a relative path without leading or trailing slashes."""
+    path = pathname.replace("\\", "/").strip("/")
+    while path.startswith("./"):
+        path = path[2:]
+    if path == ".":
+        return ""
+    if ".." in path.split("/"):
+        raise RuntimeError(f"archive entry {pathname} points outside of the archive")
+    return path
+
+
+def inspect_archive(archive: bytes) -> "tuple[str, int]":
+    """Locate the mod inside an archive by reading only the entry headers.
+
+    A usable archive either has config.toml at its top level, or a single top level folder.
+
+    Returns: a tuple of the mod root inside the archive ("" for the top level) and the total
+    uncompressed size in bytes of the files belonging to the mod.
+    """
+    sizes = {}
+    folders = set()
     try:
-        with libarchive.public.memory_reader(archive) as la:
+        with span("manage.inspect_archive", archive_bytes=len(archive)), libarchive.public.memory_reader(archive) as la:
             for entry in la:
+                path = _entry_path(entry.pathname)
+                if not path:
+                    continue
                 if entry.filetype.IFDIR:
-                    os.makedirs(os.path.join(extract_to, entry.pathname), exist_ok=True)
+                    folders.add(path)
+                else:
+                    sizes[path] = entry.size
+                    folders.update("/".join(path.split("/")[:i]) for i in range(1, path.count("/") + 1))
+    except RuntimeError as e:
+        raise e
+    except Exception as e:
+        print_exc()
+        raise RuntimeError(f"libarchive error {e}")
+
+    top_level = {path.split("/")[0] for path in list(sizes) + list(folders)}
+    if "config.toml" in sizes:
+        mod_root = ""
+    elif len(top_level) == 1 and next(iter(top_level)) in folders:
+        mod_root = next(iter(top_level))
+    else:
+        raise RuntimeError("archive format unusable")
+
+    prefix = f"{mod_root}/" if mod_root else ""
+    return mod_root, sum(size for path, size in sizes.items() if path.startswith(prefix))
+
+
+def ensure_free_space(path: str, required_bytes: int) -> None:
+    """Raise a RuntimeError if the filesystem containing path has less than required_bytes free."""
+    free_bytes = shutil.disk_usage(path).free
+    if free_bytes < required_bytes:
+        raise RuntimeError(f"not enough free space: {required_bytes / (1024 * 1024):.1f}Mb needed, "
+                           f"{free_bytes / (1024 * 1024):.1f}Mb available")
+
+
+def extract_archive(archive: bytes, extract_to: str, mod_root: str = "", progress=None,
+                    cancelled: threading.Event = None) -> None:
+    """Extract an archive to extract_to.
+
+    Params:
+        archive - raw bytes of the archive
+        extract_to - destination folder
+        mod_root - if given, only entries below this folder are extracted, relative to it
+        progress - called with (entries extracted, bytes extracted) after every entry
+        cancelled - if given, extraction stops with api.OperationCancelled once this event is set
+    """
+    prefix = f"{mod_root}/" if mod_root else ""
+    entries = 0
+    extracted_bytes = 0
+    try:
+        with span("manage.extract_archive", archive_bytes=len(archive)) as s, \
+                metrics.timed("manage.extract_archive"), \
+                libarchive.public.memory_reader(archive) as la:
+            for entry in la:
+                path = _entry_path(entry.pathname)
+                if not path.startswith(prefix) or path == mod_root:
+                    continue  # skipped entries are not written, though solid archives still decompress them
+                if cancelled is not None and cancelled.is_set():
+                    raise api.OperationCancelled("extraction cancelled")
+                dest = os.path.join(extract_to, path[len(prefix):])
+                entries += 1
+                if entry.filetype.IFDIR:
+                    os.makedirs(dest, exist_ok=True)
                 else:
-                    dest = os.path.join(extract_to, entry.pathname)
                     os.makedirs(os.path.dirname(dest), exist_ok=True)
-                    with open(os.path.join(extract_to, entry.pathname), "xb") as fd:
+                    with open(dest, "xb") as fd:
                         for block in entry.get_blocks():
+                            extracted_bytes += len(block)
                             fd.write(block)
+                if progress:
+                    progress(entries, extracted_bytes)
+            s.set(entries=entries, extracted_bytes=extracted_bytes)
+        metrics.inc("manage.extracted_files", entries)
+        metrics.inc("manage.extracted_bytes", extracted_bytes)
+        if entries == 0:
+            raise RuntimeError(f"nothing to extract, the archive has no entries under {mod_root or 'its root'}")
 
     except Exception as e:
         if isinstance(e, RuntimeError):
@@ -194,7 +817,7 @@ def extract_archive(archive: bytes, extract_to: str) -> None:
 
 def install_modloader(diva_path: str):
     version, download_url = check_modloader_version()
-    resp = requests.get(download_url)
+    resp = net.get(download_url)
     if resp.status_code != 200:
         raise RuntimeError(f"Github API returned {resp.status_code}")
     with libarchive.public.memory_reader(resp.content) as la:
@@ -222,11 +845,14 @@ def install_modloader(diva_path: str):
 
 @functools.lru_cache(maxsize=None)
 def check_modloader_version() -> "tuple[packaging.version.Version,str]":
-    resp = requests.get(
-        f"https://api.github.com/repos/blueskythlikesclouds/DivaModLoader/releases/latest"
+    resp = net.get(
+        f"{d4m.common.GITHUB_API_DOMAIN}/repos/blueskythlikesclouds/DivaModLoader/releases/latest"
     )
     if resp.status_code != 200:
         raise RuntimeError(f"Github API returned {resp.status_code}")
     j = resp.json()
     return (packaging.version.Version(j["name"]),
             j["assets"][0]["browser_download_url"])  # TODO: don't make assumption about assets?
+
+
+metrics.register_lru_cache("check_modloader_version", check_modloader_version)
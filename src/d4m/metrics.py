@@ -0,0 +1,167 @@
+"""Counters and histograms describing what d4m did during a session.
+
+Metrics are always collected: recording one is a dict update under a lock. Each metric is
+keyed by name and an optional label (e.g. the host of a request or the name of a cache).
+`snapshot()` returns everything as a dict, `to_json`/`dump_json` serialize it, and
+`format_report()` renders it as text for the GUI and TUI.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds of the histogram buckets, the last bucket catches everything else
+BUCKET_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_lru_caches = {}
+_started = time.time()
+
+
+class Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for index, bound in enumerate(BUCKET_BOUNDS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str(bound): n for bound, n in zip(BUCKET_BOUNDS + ("inf",), self.buckets)}
+        }
+
+
+def inc(name: str, value: int = 1, label: str = ""):
+    """Add value to the counter name/label."""
+    with _lock:
+        counter = _counters.setdefault(name, {})
+        counter[label] = counter.get(label, 0) + value
+
+
+def observe(name: str, value: float, label: str = ""):
+    """Record a value, in seconds, in the histogram name/label."""
+    with _lock:
+        histogram = _histograms.setdefault(name, {})
+        if label not in histogram:
+            histogram[label] = Histogram()
+        histogram[label].observe(value)
+
+
+@contextmanager
+def timed(name: str, label: str = ""):
+    """Record how long the enclosed block took in the histogram name/label."""
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - begin, label)
+
+
+def cache_lookup(cache: str, hit: bool):
+    inc("cache.hits" if hit else "cache.misses", label=cache)
+
+
+def register_lru_cache(name: str, func):
+    """Report the cache_info() of a functools.lru_cache wrapped function in snapshots."""
+    _lru_caches[name] = func
+    return func
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = {name: dict(labels) for name, labels in _counters.items()}
+        histograms = {name: {label: h.to_dict() for label, h in labels.items()} for name, labels in _histograms.items()}
+    for name, func in _lru_caches.items():
+        info = func.cache_info()
+        counters.setdefault("cache.hits", {})[name] = info.hits
+        counters.setdefault("cache.misses", {})[name] = info.misses
+    return {
+        "session_seconds": time.time() - _started,
+        "counters": counters,
+        "histograms": histograms
+    }
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=2)
+
+
+def dump_json(path: str):
+    with open(path, "w", encoding="UTF-8") as fd:
+        fd.write(to_json())
+
+
+def reset():
+    """Clear the recorded metrics. Registered lru_caches keep their own statistics."""
+    global _started
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _started = time.time()
+
+
+def format_report() -> str:
+    """Render the current metrics as human readable text."""
+    snap = snapshot()
+    counters = snap["counters"]
+    lines = [f"Session length: {snap['session_seconds']:.0f}s", ""]
+
+    hosts = sorted(set(counters.get("http.requests", {})) | set(counters.get("http.errors", {})))
+    if hosts:
+        lines.append("Network")
+        latency = snap["histograms"].get("http.latency", {})
+        for host in hosts:
+            received = counters.get("http.bytes", {}).get(host, 0)
+            line = (f"  {host}: {counters.get('http.requests', {}).get(host, 0)} requests, "
+                    f"{counters.get('http.errors', {}).get(host, 0)} errors, {received / (1024 * 1024):.2f}Mb")
+            throttled = counters.get("http.throttled", {}).get(host, 0)
+            if throttled:
+                line += f", {throttled} throttled"
+            if host in latency:
+                line += f", {latency[host]['mean'] * 1000:.0f}ms avg / {latency[host]['max'] * 1000:.0f}ms max"
+            lines.append(line)
+        lines.append("")
+
+    caches = sorted(set(counters.get("cache.hits", {})) | set(counters.get("cache.misses", {})))
+    if caches:
+        lines.append("Caches")
+        for cache in caches:
+            hits = counters.get("cache.hits", {}).get(cache, 0)
+            misses = counters.get("cache.misses", {}).get(cache, 0)
+            ratio = hits / (hits + misses) * 100 if hits + misses else 0
+            lines.append(f"  {cache}: {hits} hits, {misses} misses ({ratio:.0f}% hit rate)")
+        lines.append("")
+
+    other_counters = [name for name in sorted(counters) if not name.startswith(("http.", "cache."))]
+    for name in other_counters:
+        for label, value in sorted(counters[name].items()):
+            lines.append(f"{name}{f' ({label})' if label else ''}: {value}")
+    for name, labels in sorted(snap["histograms"].items()):
+        if name == "http.latency":
+            continue
+        for label, h in sorted(labels.items()):
+            lines.append(f"{name}{f' ({label})' if label else ''}: {h['count']} times, "
+                         f"{h['mean'] * 1000:.1f}ms avg / {h['max'] * 1000:.1f}ms max")
+    return "\n".join(lines).rstrip()
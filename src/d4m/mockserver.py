@@ -0,0 +1,335 @@
+"""A local stand-in for the GameBanana, DivaModArchive and GitHub APIs used by d4m.
+
+Every mod id exists: mod metadata and archives are generated deterministically from the id,
+so any synthetic library can be checked for updates and installed from it. Latency, bandwidth,
+errors and rate limiting can be injected to measure d4m under realistic conditions offline.
+
+Run it standalone with `python -m d4m.mockserver`, and point d4m at it with the printed
+environment variables, or use `MockApiServer.apply()` to redirect d4m in-process.
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import random
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CHUNK_SIZE = 16 * 1024
+
+
+def _png(width=1, height=1) -> bytes:
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = b"".join(b"\0" + b"\x80\x80\x80" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+PREVIEW_PNG = _png(16, 16)
+
+
+class MockApiServer:
+    """Serves the API endpoints d4m uses from a background thread.
+
+    Params:
+        port - port to listen on, 0 picks a free one
+        latency - seconds to wait before answering each request
+        bandwidth - bytes/s for response bodies, 0 for no limit
+        error_rate - share of requests answered with a 500
+        rate_limit_rate - share of requests answered with a 429
+        archive_size - size in bytes of the payload inside every mod archive
+        version - bumping this changes the hash of every mod, making installed mods out of date
+        search_results - number of results returned by a search
+        catalog_size - number of mods listed by the catalog of each origin (ids 1 to catalog_size)
+        seed - seed for fault injection
+    """
+
+    def __init__(self, port=0, latency=0.0, bandwidth=0, error_rate=0.0, rate_limit_rate=0.0,
+                 archive_size=64 * 1024, version=1, search_results=50, catalog_size=500, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.archive_size = archive_size
+        self.version = version
+        self.search_results = search_results
+        self.catalog_size = catalog_size
+        self.random = random.Random(seed)
+        self.archives = {}  # (origin, mod id) -> archive bytes, served instead of a generated archive
+        self.revisions = {}  # (origin, str(mod id)) -> (revision, unix time), set by touch
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), functools.partial(_MockApiHandler, self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def env(self) -> "dict[str, str]":
+        """Environment variables that point d4m at this server."""
+        return {
+            "D4M_GB_BASE_DOMAIN": self.url,
+            "D4M_GB_ALT_API_DOMAIN": self.url,
+            "D4M_GB_FAVICON_URL": self.url + "/favicon.ico",
+            "D4M_DMA_BASE_DOMAIN": self.url + "/api/v1",
+            "D4M_DMA_FAVICON_URL": self.url + "/favicon.ico",
+            "D4M_GITHUB_API_DOMAIN": self.url,
+        }
+
+    def apply(self):
+        """Point the already imported d4m modules at this server."""
+        import d4m.common
+        import d4m.dma
+        import d4m.gamebanana
+        env = self.env()
+        d4m.gamebanana.GB_BASE_DOMAIN = env["D4M_GB_BASE_DOMAIN"]
+        d4m.gamebanana.GB_ALT_API_DOMAIN = env["D4M_GB_ALT_API_DOMAIN"]
+        d4m.gamebanana.GB_FAVICON_URL = env["D4M_GB_FAVICON_URL"]
+        d4m.dma.DMA_BASE_DOMAIN = env["D4M_DMA_BASE_DOMAIN"]
+        d4m.dma.DMA_FAVICON_URL = env["D4M_DMA_FAVICON_URL"]
+        d4m.common.GITHUB_API_DOMAIN = env["D4M_GITHUB_API_DOMAIN"]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="d4m-mockserver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    ### synthetic catalog
+
+    def touch(self, origin: str, mod_id):
+        """Publish a new version of a single mod: its hash changes and it moves to the top of the catalog."""
+        with self._lock:
+            revision = self.revisions.get((origin, str(mod_id)), (0, 0))[0] + 1
+            self.revisions[(origin, str(mod_id))] = (revision, time.time())
+
+    def mod_hash(self, origin: str, mod_id) -> str:
+        revision = self.revisions.get((origin, str(mod_id)), (0, 0))[0]
+        suffix = f"/{revision}" if revision else ""
+        return hashlib.md5(f"{origin}/{mod_id}/{self.version}{suffix}".encode("UTF-8")).hexdigest()
+
+    def modified_date(self, mod_id, origin: str = "gamebanana") -> float:
+        """Unix time of the last change to a mod, newer for higher ids and moved forward by version."""
+        if (origin, str(mod_id)) in self.revisions:
+            return self.revisions[(origin, str(mod_id))][1]
+        return 1600000000 + int(mod_id) * 60 + self.version
+
+    def catalog_ids(self, offset: int, limit: int, origin: str = "gamebanana") -> "list[int]":
+        """A page of the catalog, most recently modified first. Touched mods come first."""
+        touched = [int(mod_id) for (o, mod_id), _ in sorted(self.revisions.items(), key=lambda item: -item[1][1])
+                   if o == origin]
+        ids = touched[offset:offset + limit]
+        offset = max(offset - len(touched), 0)
+        newest = self.catalog_size - offset
+        ids.extend(i for i in range(newest, max(newest - (limit - len(ids)), 0), -1) if i not in touched)
+        return ids
+
+    def gamebanana_record(self, mod_id) -> dict:
+        return {
+            "_idRow": int(mod_id),
+            "_sName": f"GameBanana Mod {mod_id}",
+            "_sModelName": "Mod",
+            "_aSubmitter": {"_sName": f"author{int(mod_id) % 97}"},
+            "_tsDateModified": int(self.modified_date(mod_id, "gamebanana")),
+            "_nLikeCount": int(mod_id) % 1000,
+            "_nDownloadCount": int(mod_id) % 10000
+        }
+
+    def gamebanana_item(self, mod_id) -> list:
+        files = {
+            str(mod_id): {
+                "_tsDateAdded": 1600000000 + self.version,
+                "_sMd5Checksum": self.mod_hash("gamebanana", mod_id),
+                "_sDownloadUrl": f"{self.url}/files/gamebanana/{mod_id}/{self.version}.zip"
+            }
+        }
+        return [files, f"{self.url}/images/{mod_id}.png", int(mod_id) % 1000, int(mod_id) % 10000]
+
+    def dma_post(self, mod_id) -> dict:
+        return {
+            "id": int(mod_id),
+            "name": f"DMA Mod {mod_id}",
+            "date": datetime.fromtimestamp(self.modified_date(mod_id, "divamodarchive"),
+                                           timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "image": f"{self.url}/images/{mod_id}.png",
+            "link": f"{self.url}/files/divamodarchive/{mod_id}/{self.version}.zip",
+            "downloads": int(mod_id) % 10000,
+            "likes": int(mod_id) % 1000,
+            "user": {"name": f"author{int(mod_id) % 97}"},
+            "type_tag": 0
+        }
+
+    def search_ids(self, query: str) -> "list[int]":
+        seed = int(hashlib.md5(query.encode("UTF-8")).hexdigest()[:8], 16)
+        return [1 + (seed + i * 7919) % 1000000 for i in range(self.search_results)]
+
+    @functools.lru_cache(maxsize=64)
+    def mod_archive(self, origin: str, mod_id: str, version: str) -> bytes:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            folder = f"{origin}-{mod_id}"
+            zf.writestr(f"{folder}/config.toml",
+                        f'enabled = true\nname = "Mock mod {mod_id}"\nauthor = "mockserver"\nversion = "1.0.{version}"\n')
+            zf.writestr(f"{folder}/rom/payload.bin", random.Random(f"{origin}/{mod_id}").randbytes(self.archive_size))
+        return buf.getvalue()
+
+    @functools.lru_cache(maxsize=1)
+    def modloader_archive(self) -> bytes:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("config.toml", 'enabled = true\nmods = "mods"\n')
+            zf.writestr("dinput8.dll", b"\0" * 1024)
+        return buf.getvalue()
+
+    def roll(self, rate: float) -> bool:
+        with self._lock:
+            return self.random.random() < rate
+
+
+class _MockApiHandler(BaseHTTPRequestHandler):
+    def __init__(self, server_state: MockApiServer, *args, **kwargs):
+        self.state = server_state
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *_):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on the response, e.g. its timeout or deadline passed
+
+    def do_GET(self):
+        state = self.state
+        with state._lock:
+            state.request_count += 1
+        if state.latency > 0:
+            time.sleep(state.latency)
+        if state.roll(state.rate_limit_rate):
+            return self.respond(429, b"Too Many Requests", "text/plain", headers={"Retry-After": "1"})
+        if state.roll(state.error_rate):
+            return self.respond(500, b"Internal Server Error", "text/plain")
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        if url.path == "/Core/Item/Data":
+            items = []
+            index = 0
+            while f"itemid[{index}]" in query:
+                items.append(state.gamebanana_item(query[f"itemid[{index}]"][0]))
+                index += 1
+            return self.respond_json(items)
+        if url.path == "/apiv9/Util/Game/Submissions":
+            per_page = int(query.get("_nPerpage", ["15"])[0])
+            offset = (int(query.get("_nPage", ["1"])[0]) - 1) * per_page
+            return self.respond_json([{
+                "_sName": f"GameBanana Mod {mod_id}",
+                "_idRow": mod_id,
+                "_aSubmitter": {"_sName": f"author{mod_id % 97}"},
+                "_sModelName": "Mod"
+            } for mod_id in state.search_ids(query.get("_sName", [""])[0])[offset:offset + per_page]])
+        if url.path == "/apiv11/Mod/Index":
+            per_page = int(query.get("_nPerpage", ["15"])[0])
+            offset = (int(query.get("_nPage", ["1"])[0]) - 1) * per_page
+            ids = state.catalog_ids(offset, per_page, "gamebanana")
+            return self.respond_json({
+                "_aMetadata": {"_nRecordCount": state.catalog_size, "_bIsComplete": offset + per_page >= state.catalog_size},
+                "_aRecords": [state.gamebanana_record(i) for i in ids]
+            })
+        if parts[:3] == ["api", "v1", "posts"] and len(parts) == 4:
+            if parts[3] == "latest":
+                name = query.get("name", [""])[0]
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", ["20"])[0])
+                if not name:  # every post, newest first
+                    return self.respond_json([state.dma_post(i) for i in state.catalog_ids(offset, limit, "divamodarchive")])
+                return self.respond_json([state.dma_post(i) for i in state.search_ids(name)[offset:offset + limit]])
+            if parts[3] == "posts":
+                return self.respond_json([state.dma_post(i) for i in query.get("post_id", [])])
+            if parts[3].isdigit():
+                return self.respond_json(state.dma_post(parts[3]))
+        if len(parts) == 5 and parts[0] == "repos" and parts[3:] == ["releases", "latest"]:
+            return self.respond_json({
+                "name": "999.0.0",
+                "assets": [{"browser_download_url": f"{state.url}/files/{parts[2]}.zip"}]
+            })
+        if len(parts) == 4 and parts[0] == "files":
+            archive = state.archives.get((parts[1], parts[2])) or state.mod_archive(parts[1], parts[2],
+                                                                                    parts[3].split(".")[0])
+            return self.respond(200, archive, "application/zip")
+        if len(parts) == 2 and parts[0] == "files":
+            return self.respond(200, state.modloader_archive(), "application/zip")
+        if len(parts) == 2 and parts[0] == "images" or url.path == "/favicon.ico":
+            return self.respond(200, PREVIEW_PNG, "image/png")
+        self.respond(404, b"Not Found", "text/plain")
+
+    def respond_json(self, obj):
+        self.respond(200, json.dumps(obj).encode("UTF-8"), "application/json")
+
+    def respond(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        bandwidth = self.state.bandwidth
+        if bandwidth <= 0:
+            self.wfile.write(body)
+            return
+        begin = time.monotonic()
+        for offset in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[offset:offset + CHUNK_SIZE])
+            ahead = (offset + CHUNK_SIZE) / bandwidth - (time.monotonic() - begin)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the APIs used by d4m")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes/s per response, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--archive-size", type=int, default=64 * 1024, help="payload size of mod archives")
+    parser.add_argument("--mod-version", type=int, default=1, help="change to make installed mods out of date")
+    parser.add_argument("--catalog-size", type=int, default=500, help="number of mods listed by each origin")
+    args = parser.parse_args()
+    server = MockApiServer(port=args.port, latency=args.latency, bandwidth=args.bandwidth,
+                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                           archive_size=args.archive_size, version=args.mod_version,
+                           catalog_size=args.catalog_size)
+    print("Serving the d4m API stand-in, point d4m at it with:")
+    for key, value in server.env().items():
+        print(f"export {key}={value}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""In-memory search and sort index over a list of installed mods.
+
+Text search uses a trigram index over each mod's name, author, origin and id, so a query only
+checks the mods sharing every trigram of its words. Sort orders are computed once per key and
+kept until the index is rebuilt or the key is invalidated.
+"""
+
+SORT_KEYS = ("name", "author", "size", "enabled", "out_of_date", "origin")
+
+
+def _trigrams(text: str) -> "set[str]":
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _out_of_date_rank(mod) -> int:
+    """0 for mods without update information, 1 for up to date mods and 2 for out of date mods.
+
+    Only information that is already known is used, this never triggers an update check.
+    """
+    if mod.is_simple() or "modinfo" not in mod.__dict__:
+        return 0
+    try:
+        return 2 if mod.is_out_of_date() else 1
+    except RuntimeError:
+        return 0
+
+
+_SORT_FUNCS = {
+    "name": lambda mod: mod.name.casefold(),
+    "author": lambda mod: mod.author.casefold(),
+    "size": lambda mod: mod.size_bytes,
+    "enabled": lambda mod: mod.enabled,
+    "out_of_date": _out_of_date_rank,
+    # by origin, then by id in numeric order (shorter digit strings are smaller numbers)
+    "origin": lambda mod: ("", 0, "") if mod.is_simple() else (mod.origin, len(str(mod.id)), str(mod.id)),
+}
+
+
+class ModIndex:
+    """Index over mods, answering with positions in the list it was built from.
+
+    Params:
+        mods - the mods to index, the index must be rebuilt when this list changes
+    """
+
+    def __init__(self, mods: list):
+        self.mods = list(mods)
+        self._texts = []
+        self._trigrams = {}  # trigram -> positions of the mods whose text contains it
+        self._orders = {}  # (sort key, descending) -> sorted positions
+        for position, mod in enumerate(self.mods):
+            text = " ".join([mod.name, mod.author] + ([] if mod.is_simple() else [mod.origin, str(mod.id)])).casefold()
+            self._texts.append(text)
+            for trigram in _trigrams(text):
+                self._trigrams.setdefault(trigram, set()).add(position)
+
+    def __len__(self):
+        return len(self.mods)
+
+    def search(self, query: str) -> "set[int]":
+        """Return the positions of the mods containing every whitespace separated word of query."""
+        words = query.casefold().split()
+        if not words:
+            return set(range(len(self.mods)))
+        candidates = None
+        for word in sorted(words, key=len, reverse=True):  # long words narrow the candidates the most
+            if len(word) >= 3:
+                postings = [self._trigrams.get(trigram, set()) for trigram in _trigrams(word)]
+                found = set.intersection(*sorted(postings, key=len))
+                if candidates is not None:
+                    found &= candidates
+            else:
+                found = candidates if candidates is not None else range(len(self.mods))
+            # trigrams can match in different places, confirm the word itself is there
+            candidates = {position for position in found if word in self._texts[position]}
+            if not candidates:
+                break
+        return candidates
+
+    def order(self, key: str, descending: bool = False) -> "list[int]":
+        """Return every position, sorted by key (one of SORT_KEYS). Ties keep list order."""
+        if (key, descending) not in self._orders:
+            sort_func = _SORT_FUNCS[key]
+            self._orders[(key, descending)] = sorted(range(len(self.mods)), reverse=descending,
+                                                     key=lambda position: sort_func(self.mods[position]))
+        return list(self._orders[(key, descending)])
+
+    def invalidate(self, key: str = None):
+        """Forget the sort order of key, or of every key, e.g. after update checks changed out_of_date."""
+        if key is None:
+            self._orders.clear()
+        else:
+            self._orders.pop((key, False), None)
+            self._orders.pop((key, True), None)
@@ -0,0 +1,274 @@
+"""HTTP helpers shared by every network request d4m makes.
+
+Requests to each host go through a HostLimiter, which spaces them out with a token bucket and
+caps how many run at once. The cap adapts AIMD-style: it grows by about one request per round
+trip while the host answers quickly, and halves when the host throttles (429/503) or its
+latency climbs well above what it normally is.
+
+Every request has connect and read timeouts. Composite operations can also bound the requests a
+thread makes with `deadline(seconds)`, and latency sensitive reads can be hedged: if the first
+attempt is slow, a second one is sent and whichever answers first is used.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+import d4m.metrics as metrics
+from d4m.tracing import span
+
+# host -> (requests per second, burst) of its token bucket, hosts not listed are only limited by concurrency
+RATE_LIMITS = {
+    "api.gamebanana.com": (10, 20),
+    "gamebanana.com": (10, 20),
+    "images.gamebanana.com": (20, 40),
+    "divamodarchive.com": (10, 20),
+}
+INITIAL_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+DECREASE_FACTOR = 0.5
+LATENCY_TOLERANCE = 3  # a response this many times slower than the host's usual latency means congestion
+MIN_CONGESTED_LATENCY = 0.5  # seconds, faster responses never count as congestion
+BASELINE_DRIFT = 0.05  # how fast the usual latency follows slower responses
+THROTTLED_STATUSES = (429, 503)
+DEFAULT_RETRY_AFTER = 1  # seconds to pause a host that throttled without a Retry-After header
+MAX_RETRY_AFTER = 30
+THROTTLE_RETRIES = 3  # times a throttled request is sent again before its response is returned
+DEFAULT_TIMEOUT = (5, 30)  # seconds to connect, and to wait for each read of the response
+QUICK_TIMEOUT = (2, 5)  # for requests that are not worth waiting for, like favicons
+METADATA_HEDGE_AFTER = None  # seconds before a mod metadata request is hedged, None to never hedge
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class HostLimiter:
+    """Rate and concurrency limit of the requests to one host, shared by every thread.
+
+    Params:
+        rate - requests per second allowed by the token bucket, None for no rate limit
+        burst - requests that can be sent at once after a quiet period, rate by default
+    """
+
+    def __init__(self, rate: float = None, burst: float = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.limit = float(INITIAL_CONCURRENCY)  # requests allowed in flight
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._paused_until = 0
+        self._baseline = None  # usual latency of the host
+        self._last_decrease = 0
+
+    def acquire(self, until: float = None) -> bool:
+        """Wait until a request to the host may be sent.
+
+        Params:
+            until - time.monotonic() after which to give up waiting
+
+        Returns: False if until passed first, the request must not be sent then.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0 and self._active < int(self.limit):
+                    if self.rate is None:
+                        break
+                    self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                    self._refilled = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                if until is not None:
+                    if now >= until:
+                        return False
+                    wait = min(wait, until - now) if wait > 0 else until - now
+                self._cond.wait(wait if wait > 0 else None)
+            self._active += 1
+            return True
+
+    def release(self, latency: float = None, retry_after: float = None):
+        """Report the end of a request sent after acquire.
+
+        Params:
+            latency - seconds the host took to answer, None if the request failed
+            retry_after - seconds to wait before the next request if the host throttled this one
+        """
+        with self._cond:
+            self._active -= 1
+            now = time.monotonic()
+            if retry_after is not None:
+                self._decrease(now)
+                self._paused_until = max(self._paused_until, now + retry_after)
+            elif latency is not None:
+                if self._baseline is None or latency < self._baseline:
+                    self._baseline = latency
+                else:
+                    self._baseline += (latency - self._baseline) * BASELINE_DRIFT
+                if latency > max(self._baseline * LATENCY_TOLERANCE, MIN_CONGESTED_LATENCY):
+                    self._decrease(now)
+                else:
+                    self.limit = min(MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, now: float):
+        # the requests in flight saw the same congestion, only back off once per round trip
+        if now - self._last_decrease > max(self._baseline or 0, MIN_CONGESTED_LATENCY):
+            self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE_FACTOR)
+            self._last_decrease = now
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(host: str) -> HostLimiter:
+    """Return the limiter of host (a URL netloc), created on first use from RATE_LIMITS."""
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(*RATE_LIMITS.get(host, (None, None)))
+        return _limiters[host]
+
+
+def set_rate_limit(host: str, rate: float = None, burst: float = None):
+    """Change the token bucket of host, None removes its rate limit. Its concurrency state is kept."""
+    RATE_LIMITS[host] = (rate, burst)
+    host_limiter = limiter(host)
+    with host_limiter._cond:
+        host_limiter.rate = rate
+        host_limiter.burst = burst or rate
+        host_limiter._tokens = host_limiter.burst
+        host_limiter._cond.notify_all()
+
+
+_local = threading.local()
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="d4m-hedge")
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Make the requests of this thread in the enclosed block raise DeadlineExceeded after seconds.
+
+    Request timeouts are shortened to the time left. Nested deadlines keep the earliest.
+    """
+    previous = getattr(_local, "until", None)
+    until = time.monotonic() + seconds
+    _local.until = until if previous is None else min(previous, until)
+    try:
+        yield
+    finally:
+        _local.until = previous
+
+
+def current_deadline() -> float:
+    """Return the time.monotonic() at which the deadline of this thread passes, None without one."""
+    return getattr(_local, "until", None)
+
+
+def _retry_after(resp: requests.Response) -> float:
+    try:
+        seconds = float(resp.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:  # an HTTP date, rare enough not to parse
+        seconds = DEFAULT_RETRY_AFTER
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def _timeout(timeout, until: float):
+    """Shorten timeout (seconds, or a (connect, read) tuple) to the time left until until."""
+    if until is None:
+        return timeout
+    left = until - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("deadline exceeded")
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def get(url: str, hedge: float = None, **kwargs) -> requests.Response:
+    """Perform a GET request. Takes the same arguments as requests.get.
+
+    Throttled requests are sent again once the host allows it, up to THROTTLE_RETRIES times. Streamed
+    bodies are read after the host's limiter was released. Without a timeout argument, DEFAULT_TIMEOUT
+    is used.
+
+    Params:
+        hedge - seconds after which a second identical request is sent if no response arrived yet,
+                the first response is returned. Ignored for streamed requests.
+
+    Raises: DeadlineExceeded if the deadline of the thread passes before a response arrived.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    until = getattr(_local, "until", None)
+    if hedge is None or kwargs.get("stream"):
+        return _get(url, until, kwargs)
+    host = urlparse(url).netloc
+    attempts = [_hedge_pool.submit(_get, url, until, kwargs)]
+    done, _ = wait(attempts, timeout=hedge)
+    if not done:
+        metrics.inc("http.hedged", label=host)
+        attempts.append(_hedge_pool.submit(_get, url, until, kwargs))
+    pending = set(attempts)
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = next((f for f in attempts if f in done and f.exception() is None), None)
+        if winner is not None:
+            if winner is not attempts[0]:
+                metrics.inc("http.hedge_wins", label=host)
+            return winner.result()
+        if not pending:  # every attempt failed
+            return attempts[0].result()
+
+
+def _get(url: str, until: float, kwargs: dict) -> requests.Response:
+    host = urlparse(url).netloc
+    host_limiter = limiter(host)
+    for attempt in range(THROTTLE_RETRIES + 1):
+        timeout = _timeout(kwargs["timeout"], until)
+        if not host_limiter.acquire(until):
+            raise DeadlineExceeded(f"deadline exceeded while waiting to contact {host}")
+        metrics.inc("http.requests", label=host)
+        latency = retry_after = None  # both stay None when the request fails, which releases neutrally
+        try:
+            begin = time.perf_counter()
+            with span("http.get", host=host, url=url) as s:
+                try:
+                    resp = requests.get(url, **dict(kwargs, timeout=timeout))
+                except requests.exceptions.RequestException:
+                    metrics.inc("http.errors", label=host)
+                    if until is not None and time.monotonic() >= until:
+                        raise DeadlineExceeded(f"deadline exceeded while waiting for {host}")
+                    raise
+                s.set(status=resp.status_code, content_length=resp.headers.get("Content-Length"))
+            elapsed = time.perf_counter() - begin
+            if resp.status_code in THROTTLED_STATUSES:
+                retry_after = _retry_after(resp)
+            else:
+                latency = elapsed
+        finally:  # every way out of the request gives its slot back exactly once
+            host_limiter.release(latency, retry_after)
+        metrics.observe("http.latency", elapsed, label=host)
+        if resp.status_code >= 400:
+            metrics.inc("http.errors", label=host)
+        if retry_after is not None:
+            metrics.inc("http.throttled", label=host)
+            if attempt < THROTTLE_RETRIES and (until is None or time.monotonic() + retry_after < until):
+                resp.close()
+                continue
+        break
+    if kwargs.get("stream"):  # body not read yet, count what the server announced
+        metrics.inc("http.bytes", int(resp.headers.get("Content-Length") or 0), label=host)
+    else:
+        metrics.inc("http.bytes", len(resp.content), label=host)
+    return resp
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+import time
+from traceback import print_exc
+
+import d4m.net as net
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UpdatePrefetcher:
+    """Downloads the archives of out of date mods in the background.
+
+    Archives are stored in the prefetch folder until the update is confirmed, at which
+    point `take` hands the archive over so the update only needs a local extract.
+    Downloads are limited to `bandwidth_limit` bytes/s (0 for no limit), and stop once the
+    prefetch folder would grow past `quota_bytes`.
+    """
+
+    def __init__(self, prefetch_path: str, bandwidth_limit: int = 0, quota_bytes: int = 0):
+        self.prefetch_path = prefetch_path
+        self.bandwidth_limit = bandwidth_limit
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._pending = []
+        self._in_progress = {}
+        self._taken = set()
+        self._thread = None
+        os.makedirs(self.prefetch_path, exist_ok=True)
+        for file in os.listdir(self.prefetch_path):
+            if file.endswith(".part"):  # interrupted by a previous session
+                os.remove(os.path.join(self.prefetch_path, file))
+
+    def start(self, mods: list):
+        """Start prefetching the latest archives of mods in the background.
+
+        Params:
+            mods - out of date mods, whose modinfo is already known
+        """
+        with self._lock:
+            self._pending = [(mod.origin, mod.id, mod.modinfo["hash"], mod.modinfo["download"]) for mod in mods]
+            wanted = {_prefetch_key(origin, mod_id, mod_hash) for origin, mod_id, mod_hash, _ in self._pending}
+            for file in os.listdir(self.prefetch_path):
+                if file not in wanted and not file.endswith(".part"):  # archives of versions no longer needed
+                    os.remove(os.path.join(self.prefetch_path, file))
+            self._taken.clear()
+            self._cancelled.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="d4m-update-prefetch", daemon=True)
+                self._thread.start()
+
+    def cancel(self):
+        with self._lock:
+            self._pending = []
+        self._cancelled.set()
+
+    def take(self, origin: str, mod_id, mod_hash: str):
+        """Return the prefetched archive for this version of a mod, or None if it is not available.
+
+        If the archive is currently being downloaded, this waits for the download to finish.
+        The archive is removed from the prefetch folder once taken.
+        """
+        key = _prefetch_key(origin, mod_id, mod_hash)
+        with self._lock:
+            self._taken.add(key)
+            in_progress = self._in_progress.get(key)
+        if in_progress:
+            in_progress.wait()
+        path = os.path.join(self.prefetch_path, key)
+        try:
+            with open(path, "rb") as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return data
+
+    def used_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(self.prefetch_path, f)) for f in os.listdir(self.prefetch_path))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                origin, mod_id, mod_hash, download_url = self._pending.pop(0)
+                key = _prefetch_key(origin, mod_id, mod_hash)
+                if key in self._taken or os.path.exists(os.path.join(self.prefetch_path, key)):
+                    continue
+                done = threading.Event()
+                self._in_progress[key] = done
+            try:
+                self._download(download_url, key)
+            except Exception:
+                print_exc()
+            finally:
+                with self._lock:
+                    self._in_progress.pop(key)
+                done.set()
+
+    def _download(self, download_url: str, key: str):
+        path = os.path.join(self.prefetch_path, key)
+        available = self.quota_bytes - self.used_bytes() if self.quota_bytes > 0 else None
+        complete = False
+        with net.get(download_url, stream=True) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"Failed to prefetch mod from {download_url}")
+            if available is not None and int(resp.headers.get("Content-Length", 0)) > available:
+                return
+            begin = time.monotonic()
+            received = 0
+            with open(path + ".part", "wb") as fd:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    received += len(chunk)
+                    if self._cancelled.is_set() or (available is not None and received > available):
+                        break
+                    fd.write(chunk)
+                    if self.bandwidth_limit > 0:
+                        ahead = received / self.bandwidth_limit - (time.monotonic() - begin)
+                        if ahead > 0:
+                            self._cancelled.wait(ahead)
+                else:
+                    complete = True
+        if complete:
+            os.replace(path + ".part", path)
+        else:
+            os.remove(path + ".part")
+
+
+def _prefetch_key(origin: str, mod_id, mod_hash: str) -> str:
+    """File name of a prefetched archive. Hashes are not always filename safe (DMA uses dates)."""
+    return hashlib.sha1(f"{origin}/{mod_id}/{mod_hash}".encode("UTF-8")).hexdigest()
@@ -0,0 +1,115 @@
+"""Profiling of whole d4m sessions, for reports about d4m being slow.
+
+A session is profiled with cProfile, written as a .pstats file, and with a stack sampler covering
+every thread, written as collapsed stacks (one `frame;frame;frame count` line per stack) that
+flamegraph tools such as flamegraph.pl or speedscope read directly.
+Profiling is requested with --profile or by setting D4M_PROFILE, and the files are written to
+the d4m cache folder when the session ends.
+"""
+import atexit
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import appdirs
+
+PROFILE_DIR = os.path.join(appdirs.user_cache_dir("d4m"), "profiles")
+SAMPLE_INTERVAL = 0.005
+
+
+class StackSampler:
+    """Samples the stacks of all threads at a fixed interval."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="d4m-stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str):
+        with open(path, "w", encoding="UTF-8") as fd:
+            for stack, count in self.samples.most_common():
+                fd.write(f"{stack} {count}\n")
+
+
+class SessionProfiler:
+    def __init__(self):
+        self.profile = None
+        self.sampler = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.sampler = StackSampler()
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self) -> "tuple[str, str]":
+        """Stop profiling and write the results.
+
+        Returns: the paths of the pstats file and the collapsed stacks file.
+        """
+        self.profile.disable()
+        self.sampler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, time.strftime("d4m-%Y%m%d-%H%M%S"))
+        self.profile.dump_stats(base + ".pstats")
+        self.sampler.write_collapsed(base + ".collapsed")
+        self.profile = None
+        self.sampler = None
+        return base + ".pstats", base + ".collapsed"
+
+
+session_profiler = SessionProfiler()
+_exit_hook_registered = False
+
+
+def profiling_requested() -> bool:
+    return "--profile" in sys.argv or bool(os.environ.get("D4M_PROFILE"))
+
+
+def start_session_profile():
+    """Profile the rest of the session, writing the results when d4m exits."""
+    global _exit_hook_registered
+    session_profiler.start()
+    if not _exit_hook_registered:
+        atexit.register(_finish_session_profile)
+        _exit_hook_registered = True
+
+
+def _finish_session_profile():
+    if session_profiler.running:
+        pstats_path, collapsed_path = session_profiler.stop()
+        print(f"Profile written to {pstats_path} and {collapsed_path}")
@@ -0,0 +1,173 @@
+"""Lightweight tracing of d4m's hot paths.
+
+Wrap work in `span("name", attr=value)` to record how long it took. Tracing is off unless
+`enable()` is called or the D4M_TRACE environment variable is set to an output path, in which
+case the spans are written there when d4m exits: as JSON lines if the path ends in .jsonl,
+otherwise in Chrome trace-event format (viewable in chrome://tracing or Perfetto).
+While disabled, `span` returns a shared no-op object, so instrumented code pays one call.
+"""
+import atexit
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("id", "parent", "name", "attrs", "thread", "start_ns", "duration_ns")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.duration_ns = None
+
+    def set(self, **attrs):
+        """Add attributes to the span, e.g. sizes only known once the work is done."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        self.id = next(_ids)
+        self.parent = stack[-1].id if stack else None
+        self.thread = threading.get_ident()
+        stack.append(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, _tb):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        _stack().pop()
+        if exc_type is not None:
+            self.attrs["error"] = repr(exc)
+        with _lock:
+            _spans.append(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "thread": self.thread,
+            "start_us": self.start_ns / 1000,
+            "duration_us": self.duration_ns / 1000,
+            "attrs": self.attrs
+        }
+
+
+def _stack() -> list:
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def span(name: str, **attrs):
+    """Return a context manager timing the enclosed block as a span named `name`."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def traced(name: str = None):
+    """Decorator recording every call of the decorated function as a span."""
+
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def spans() -> "list[dict]":
+    """Return the finished spans, in the order they finished."""
+    with _lock:
+        return [s.to_dict() for s in _spans]
+
+
+def clear():
+    with _lock:
+        _spans.clear()
+
+
+def export_jsonl(path: str):
+    """Write the finished spans to path, one JSON object per line."""
+    with open(path, "w", encoding="UTF-8") as fd:
+        for s in spans():
+            fd.write(json.dumps(s, default=str) + "\n")
+
+
+def export_chrome(path: str):
+    """Write the finished spans to path in Chrome trace-event format."""
+    pid = os.getpid()
+    events = [{
+        "name": s["name"],
+        "cat": "d4m",
+        "ph": "X",
+        "ts": s["start_us"],
+        "dur": s["duration_us"],
+        "pid": pid,
+        "tid": s["thread"],
+        "args": s["attrs"]
+    } for s in spans()]
+    with open(path, "w", encoding="UTF-8") as fd:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fd, default=str)
+
+
+def export(path: str):
+    """Write the finished spans to path, as JSON lines for .jsonl files and Chrome trace-events otherwise."""
+    if path.endswith(".jsonl"):
+        export_jsonl(path)
+    else:
+        export_chrome(path)
+
+
+if os.environ.get("D4M_TRACE"):
+    enable()
+    atexit.register(export, os.environ["D4M_TRACE"])
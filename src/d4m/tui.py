@@ -1,27 +1,106 @@
 import os
 import subprocess
 import sys
+import threading
 import time
 
+import appdirs
 import colorama
 import packaging
 from simple_term_menu import TerminalMenu
 
 import d4m.api as api
+import d4m.catalog as catalog
+import d4m.metrics as metrics
+import d4m.net as net
 from d4m.common import (VERSION, get_modloader_info,
                         modloader_is_installed, fetch_latest_d4m_version)
 from d4m.global_config import D4mConfig
-from d4m.manage import ModManager, check_modloader_version, install_modloader
+from d4m.manage import ModManager, UpdateCheckError, check_modloader_version, install_modloader
+from d4m.modindex import ModIndex
+from d4m.profiling import profiling_requested, start_session_profile
 
 from traceback import print_exc
 
 
-def generate_preview(mod_str: str, mod_manager: ModManager):
+class PreviewPrefetcher:
+    """Resolves the update status of the mods around the menu cursor in the background.
+
+    Previews are rendered from what is already known, so moving the cursor never waits on the network.
+    """
+    RADIUS = 8
+
+    def __init__(self, mod_manager: ModManager):
+        self.mod_manager = mod_manager
+        self.labels = {}  # menu label -> (position, mod)
+        self.errors = {}  # mod path -> why its update check failed
+        self._wanted = []
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="d4m-preview-prefetch", daemon=True)
+        self._thread.start()
+
+    def reindex(self):
+        """Rebuild the label index, call whenever the mod list changed."""
+        labels = {}
+        for position, mod in enumerate(self.mod_manager.mods):
+            labels.setdefault(str(mod), (position, mod))  # first match wins, like the linear search did
+        self.labels = labels
+        self.errors = {}
+
+    def lookup(self, label: str):
+        """Return the mod shown as label, and queue its neighbours to be resolved."""
+        found = self.labels.get(label)
+        if found is None:
+            return None
+        self.request_around(found[0])
+        return found[1]
+
+    def request_around(self, position: int):
+        mods = self.mod_manager.mods
+        nearby = sorted(range(max(0, position - self.RADIUS), min(len(mods), position + self.RADIUS + 1)),
+                        key=lambda i: abs(i - position))
+        wanted = [mods[i] for i in nearby if not mods[i].is_simple() and not self.is_resolved(mods[i])]
+        with self._cond:
+            self._wanted = wanted  # the cursor moved on, older requests no longer matter
+            self._cond.notify()
+
+    def is_resolved(self, mod) -> bool:
+        return "modinfo" in mod.__dict__ or mod.path in self.errors
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._wanted and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                batch, self._wanted = self._wanted, []
+            by_origin = {}
+            for mod in batch:
+                by_origin.setdefault(mod.origin, []).append(mod)
+            for origin, mods in by_origin.items():
+                try:
+                    # one request for the whole batch, modinfo is then served from the API cache
+                    api.multi_fetch_mod_data({(mod.id, mod.category) for mod in mods}, origin=origin)
+                    for mod in mods:
+                        mod.modinfo
+                except Exception as e:
+                    for mod in mods:
+                        if "modinfo" not in mod.__dict__:
+                            self.errors[mod.path] = str(e)
+
+
+def generate_preview(mod_str: str, mod_manager: ModManager, prefetcher: PreviewPrefetcher):
     content = []
-    found = list(filter(lambda x: str(x) == mod_str, mod_manager.mods))
-    if not found:
+    mod = prefetcher.lookup(mod_str)
+    if mod is None:
         return ""
-    mod = found[0]
     content.append(f"Name: {mod.name}")
     content.append(f"Author: {mod.author}")
     content.append(f"Version: {mod.version}")
@@ -32,40 +111,66 @@ def generate_preview(mod_str: str, mod_manager: ModManager):
     if not mod.is_simple():
         content.append(f"Origin: {mod.origin}")
         content.append(f"Mod ID: {mod.id}")
-        try:
+        if mod.path in prefetcher.errors:
+            utd_str = f"Failed to check update: {colorama.Fore.RED}{prefetcher.errors[mod.path]}{colorama.Fore.RESET}"
+        elif "modinfo" not in mod.__dict__:
+            utd_str = "Checking for updates..."
+        else:
             utd_str = f"{colorama.Fore.YELLOW}Out of date{colorama.Fore.RESET}" if mod.is_out_of_date() else f"{colorama.Fore.GREEN}Up to date{colorama.Fore.RESET}"
-        except RuntimeError as e:
-            utd_str = f"Failed to check update: {colorama.Fore.RED}{e}{colorama.Fore.RESET}"
         content.append(utd_str)
 
     return "\n".join(content)
 
 
-def menu_install(mod_manager: ModManager):
+def menu_install(mod_manager: ModManager, mod_catalog: catalog.ModCatalog = None):
     search_str = input("Search for a mod...:")
-    gb_mods = api.search_mods(search_str, origin="gamebanana")
-    dma_mods = api.search_mods(search_str, origin="divamodarchive")
-    found_mods = gb_mods + dma_mods
-    installed_ids = [mod.id for mod in mod_manager.mods if not mod.is_simple()]
+    sort = "relevance"
+    if mod_catalog is not None:  # only the mirror can sort results
+        sort_orders = list(catalog.SORT_ORDERS)
+        sort = sort_orders[TerminalMenu(sort_orders, title="Sort by").show() or 0]
+    pagers = {origin: catalog.iter_search_pages(search_str, origin, mod_catalog, sort=sort)
+              for origin in ("gamebanana", "divamodarchive")}
+    found_mods = []
+
+    def load_more():
+        pages, errors = api.next_pages(pagers)
+        for origin, e in errors.items():
+            del pagers[origin]
+            print(f"{colorama.Fore.RED}Failed to search {origin}:{colorama.Fore.RESET} {e}")
+        for origin, page in pages.items():
+            if page is None:
+                del pagers[origin]
+            else:
+                found_mods.extend(mod_manager.annotate_installed(page))
+
+    load_more()
     if not found_mods:
         print(f"No mods matching {colorama.Style.BRIGHT}{search_str}{colorama.Style.RESET_ALL} found.")
     else:
-        options = ["Cancel"]
-
         def mod_str_gen(m_t):
             mod_name = m_t["name"].strip().replace("\n", "")
             mod_author = m_t["author"].strip().replace("\n", "")
             content = f"{mod_name} by {mod_author} [{m_t['origin']}]"
-            if m_t['id'] in installed_ids:
+            if m_t["installed"]:
                 return f"(installed) {content}"
             return content
 
-        options.extend(map(mod_str_gen, found_mods))
-        mod_search_menu = TerminalMenu(options)
-        choice = mod_search_menu.show()
-        if 0 < choice < len(options):
+        cursor = 0
+        while True:
+            options = ["Cancel"]
+            options.extend(map(mod_str_gen, found_mods))
+            if pagers:
+                options.append("Load more...")
+            mod_search_menu = TerminalMenu(options, cursor_index=min(cursor, len(options) - 1))
+            choice = mod_search_menu.show()
+            if pagers and choice == len(options) - 1:
+                cursor = len(found_mods) + 1  # first of the new results
+                load_more()
+                continue
+            break
+        if choice is not None and 0 < choice < len(found_mods) + 1:
             mod = found_mods[choice - 1]
-            if mod["id"] in installed_ids:
+            if mod["installed"]:
                 print(f"{mod['name']} is already installed.")
             else:
                 try:
@@ -80,34 +185,54 @@ def menu_install(mod_manager: ModManager):
 def menu_manage(mod_manager: ModManager):
     KEY_MOVE_UP = "w"
     KEY_MOVE_DOWN = "s"
+    KEY_FILTER = "f"
     SHIFT_LUT = {
         KEY_MOVE_UP: -1,
         KEY_MOVE_DOWN: 1
     }
     idx = 0
+    mod_filter = ""
+    prefetcher = PreviewPrefetcher(mod_manager)
     while True:
-        options = [str(mod) for mod in mod_manager.mods]
-        menu = TerminalMenu(options, preview_command=lambda x: generate_preview(x, mod_manager),
+        mods = mod_manager.mods
+        shown = list(range(len(mods)))  # positions in mods, in priority order
+        if mod_filter:
+            shown = sorted(ModIndex(mods).search(mod_filter))
+            if not shown:
+                print(f"{colorama.Fore.RED}No mods match \"{mod_filter}\"{colorama.Fore.RESET}")
+                mod_filter = ""
+                shown = list(range(len(mods)))
+        options = [str(mods[position]) for position in shown]
+        prefetcher.reindex()
+        if mod_filter:
+            status_bar = f"q to exit, {KEY_FILTER} to change filter \"{mod_filter}\" ({len(shown)}/{len(mods)} shown)"
+        else:
+            status_bar = f"q to exit, / to search, {KEY_FILTER} to filter, {KEY_MOVE_UP}/{KEY_MOVE_DOWN} to adjust priority"
+        menu = TerminalMenu(options, preview_command=lambda x: generate_preview(x, mod_manager, prefetcher),
                             preview_title="Mod Info", preview_size=0.5,
-                            status_bar=f"q to exit, / to search, {KEY_MOVE_UP}/{KEY_MOVE_DOWN} to adjust priority",
-                            cursor_index=idx, accept_keys=["enter", KEY_MOVE_UP, KEY_MOVE_DOWN]
+                            status_bar=status_bar,
+                            cursor_index=max(0, min(idx, len(options) - 1)),
+                            accept_keys=["enter", KEY_MOVE_UP, KEY_MOVE_DOWN, KEY_FILTER]
                             )
         idx = menu.show()
         selected_key = menu.chosen_accept_key
         if idx is None:
+            prefetcher.stop()
             return
-        if selected_key in SHIFT_LUT.keys():
-            new_index = idx + SHIFT_LUT[selected_key]
-            if 0 <= new_index < len(mod_manager.mods):
-                t = mod_manager.mods[idx]
-                mod_manager.mods[idx] = mod_manager.mods[new_index]
-                mod_manager.mods[new_index] = t
-                mod_manager.save_priority()
+        if selected_key == KEY_FILTER:
+            mod_filter = input("Filter (empty to show all): ").strip()
+            idx = 0
+        elif selected_key in SHIFT_LUT.keys() and mod_filter:
+            # neighbours in a filtered list are not neighbours in priority
+            print(f"{colorama.Fore.RED}Clear the filter to adjust priority{colorama.Fore.RESET}")
+        elif selected_key in SHIFT_LUT.keys():
+            new_index = mod_manager.shift_priority(mods[idx], SHIFT_LUT[selected_key])
+            if new_index is not None:
                 idx = new_index
             else:
                 print(f"{colorama.Fore.RED}Cannot shift out of bounds{colorama.Fore.RESET}")
-        elif 0 < idx < len(options):
-            selected_mod = mod_manager.mods[idx]
+        elif 0 <= idx < len(options):
+            selected_mod = mods[shown[idx]]
             mod_is_enabled = mod_manager.is_enabled(selected_mod)
             editor = os.environ.get("EDITOR", "nano")
             inner_options = [
@@ -115,7 +240,8 @@ def menu_manage(mod_manager: ModManager):
                 "[d] Disable" if mod_is_enabled else "[e] Enable",
                 "(update unavailable)" if selected_mod.is_simple() else "[u] Update",
                 "[x] Delete",
-                f"[e] Edit mod config... ({editor})"
+                f"[e] Edit mod config... ({editor})",
+                "[r] Roll back to previous version" if mod_manager.can_rollback(selected_mod) else "(no previous version)"
             ]
             inner_menu = TerminalMenu(inner_options, title=str(selected_mod))
             inner_choice = inner_menu.show()
@@ -143,6 +269,12 @@ def menu_manage(mod_manager: ModManager):
                     print(f"{colorama.Fore.RED}{selected_mod} deleted.{colorama.Fore.RESET}")
             elif inner_choice == 4:
                 subprocess.run([editor, os.path.join(selected_mod.path, "config.toml")])
+            elif inner_choice == 5 and mod_manager.can_rollback(selected_mod):
+                try:
+                    restored = mod_manager.rollback(selected_mod)
+                    print(f"{colorama.Fore.GREEN}Rolled back to {restored}{colorama.Fore.RESET}")
+                except Exception as e:
+                    print(f"{colorama.Fore.RED}Failed to roll back {selected_mod.name}: {e}{colorama.Fore.RESET}")
 
 
 def do_update_all(mod_manager: ModManager):
@@ -162,26 +294,32 @@ def edit_d4m_config(*args):
 
 
 def migrate_from_dmm(mod_manager: ModManager):
-    attempted = 0
-    successful = 0
-    for mod in mod_manager.mods:
-        if mod.is_simple() and mod.can_attempt_dmm_migration():
-            print(f"Attempting to migrate {mod.name}...")
-            attempted += 1
-            res = mod.attempt_migrate_from_dmm()
-            if res:
-                print(f"{colorama.Fore.GREEN}Successfully migrated {mod.name}.{colorama.Fore.RESET}")
-                successful += 1
-            else:
-                print(f"{colorama.Fore.RED}Couldn't migrate {mod.name}{colorama.Fore.RESET}")
+    print("Migrating mods from DivaModManager...")
+    migrated, failed = mod_manager.migrate_from_dmm()
+    for mod in migrated:
+        print(f"{colorama.Fore.GREEN}Successfully migrated {mod.name}.{colorama.Fore.RESET}")
+    for mod in failed:
+        print(f"{colorama.Fore.RED}Couldn't migrate {mod.name}{colorama.Fore.RESET}")
+    attempted = len(migrated) + len(failed)
     if attempted > 0:
-        print(f"Attempted to migrate {attempted} mods, {successful} successful.")
+        print(f"Attempted to migrate {attempted} mods, {len(migrated)} successful.")
     else:
         print(f"No mods eligible for migration.")
-    mod_manager.reload()
+
+
+def show_statistics(*_):
+    print(metrics.format_report())
+    menu = TerminalMenu(["Back", "Save as JSON"])
+    if menu.show() == 1:
+        os.makedirs(appdirs.user_cache_dir("d4m"), exist_ok=True)
+        path = os.path.join(appdirs.user_cache_dir("d4m"), time.strftime("d4m-statistics-%Y%m%d-%H%M%S.json"))
+        metrics.dump_json(path)
+        print(f"Statistics saved to {path}")
 
 
 def main():
+    if profiling_requested():
+        start_session_profile()
     print(f"d4m v{VERSION}")
 
     d4m_config = D4mConfig()
@@ -239,9 +377,26 @@ def main():
                     sys.exit(2)
 
     os.makedirs(mods_path, exist_ok=True)
-    mod_manager = ModManager(megamix_path, mods_path)
+    mod_manager = ModManager(megamix_path, mods_path, generations_kept=d4m_config["update_generations_kept"])
+
+    if d4m_config["hedge_metadata_after_ms"] > 0:
+        net.METADATA_HEDGE_AFTER = d4m_config["hedge_metadata_after_ms"] / 1000
+
+    if d4m_config["prefetch_updates"]:
+        mod_manager.enable_prefetch(bandwidth_limit=d4m_config["prefetch_bandwidth_limit_kb"] * 1024,
+                                    quota_bytes=d4m_config["prefetch_quota_mb"] * 1024 * 1024)
+
+    mod_catalog = None
+    if d4m_config["catalog_search"]:
+        try:
+            mod_catalog = catalog.ModCatalog()
+            catalog.sync_in_background(mod_catalog, d4m_config["catalog_sync_hours"] * 60 * 60)
+        except RuntimeError as e:
+            print(f"{colorama.Fore.RED}Searching online, the mod catalog is unavailable:{colorama.Fore.RESET} {e}")
 
     print(f"{len(mod_manager.mods)} mods installed")
+    if mod_manager.has_leftovers:
+        print("Removing previously deleted mods in the background")
     print(f"{colorama.Fore.YELLOW}Checking for mod updates...{colorama.Fore.RESET}")
     begin = time.time()
     available_updates = -1
@@ -253,14 +408,20 @@ def main():
             print(f"{colorama.Fore.GREEN}All mods up-to-date.{colorama.Fore.RESET}")
         else:
             print(f"{colorama.Fore.YELLOW}{available_updates} mods have updates available.{colorama.Fore.RESET}")
+    except UpdateCheckError as e:  # the other origins were checked
+        for origin, error in e.errors.items():
+            print(f"{colorama.Fore.RED}Failed to check {origin} for mod updates:{colorama.Fore.RESET} {error}")
+        available_updates = sum(1 for origin in api.SUPPORTED_APIS.keys() if origin not in e.errors
+                                for mod in mod_manager.mods_from(origin) if mod.is_out_of_date())
     except RuntimeError as e:
         print(f"{colorama.Fore.RED}Failed to check for mod updates:{colorama.Fore.RESET} {e}")
 
     base_options = [
-        ("Install new mods", menu_install),
+        ("Install new mods", lambda m: menu_install(m, mod_catalog)),
         ("Manage existing mods", menu_manage),
         ("Edit d4m config", edit_d4m_config),
         ("Migrate from DivaModManager", migrate_from_dmm),
+        ("Show statistics", show_statistics),
         ("Run Project Diva", lambda *_: subprocess.run([f"xdg-open", "steam://run/{MEGAMIX_APPID}"]))
     ]
 